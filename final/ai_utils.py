@@ -1,9 +1,14 @@
 # ai_utils.py
 
-from openai import OpenAI
-from anthropic import Anthropic
 from dotenv import dotenv_values
+from datetime import datetime, timezone
+import json
 import logging
+import re
+import threading
+import time
+import metrics_utils
+from llm_cache import LLMCache
 
 # Load environment variables from .env file
 secrets = dotenv_values(".env")
@@ -12,72 +17,444 @@ secrets = dotenv_values(".env")
 OPENAI_API_KEY = secrets.get('OPENAI_API')
 ANTHROPIC_API_KEY = secrets.get('ANTHROPIC_API')
 
-# Initialize OpenAI and Anthropic clients
-try:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
-except Exception as e:
-    logging.error(f"Error initializing OpenAI client: {e}")
-    openai_client = None
+# Optional API endpoints (e.g. the local fakes in benchmarks/); None uses the SDK default
+OPENAI_BASE_URL = secrets.get('OPENAI_BASE_URL')
+ANTHROPIC_BASE_URL = secrets.get('ANTHROPIC_BASE_URL')
+
+# Starting request/token per-minute budgets per provider. They are replaced by
+# the limits reported in the rate-limit response headers after the first call.
+RATE_LIMITS = {
+    'anthropic': (int(secrets.get('ANTHROPIC_RPM', 50)), int(secrets.get('ANTHROPIC_TPM', 40000))),
+    'openai': (int(secrets.get('OPENAI_RPM', 500)), int(secrets.get('OPENAI_TPM', 200000))),
+}
+# Prompt caching beta header (the Anthropic SDK pinned in requirements.txt predates GA)
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+# Extra attempts after a 429 that survived the SDK's own retries
+RATE_LIMIT_RETRIES = int(secrets.get('RATE_LIMIT_RETRIES', 3))
+# Output tokens reserved per call before the real usage is known
+ESTIMATED_OUTPUT_TOKENS = 512
+
+# List prices in USD per million input / output tokens. Prompt cache reads are
+# billed at 10% and writes at 125% of the input price, batches at 50%.
+MODEL_PRICES = {
+    "claude-3-opus-20240229": (15.0, 75.0),
+    "claude-3-5-sonnet-20241022": (3.0, 15.0),
+    "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at capacity per minute.
+    The level may go negative when a call turns out to cost more than reserved.
+    """
+
+    def __init__(self, per_minute):
+        self._lock = threading.Lock()
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60.0)
+        self._updated = now
+
+    def acquire(self, amount):
+        """
+        Block until amount is available and take it. Returns the seconds waited.
+        """
+        # A single call may never need more than a full bucket
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return waited
+                delay = (amount - self.level) * 60.0 / self.capacity
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        # Settle the difference between the reserved and the actual cost
+        with self._lock:
+            self._refill()
+            self.level -= amount
+
+    def sync(self, limit=None, remaining=None, reset_in=None):
+        """
+        Align the bucket with what the provider reports
+        """
+        with self._lock:
+            self._refill()
+            if limit:
+                self.capacity = float(limit)
+            if remaining is not None:
+                self.level = min(self.level, float(remaining))
+                if reset_in and remaining < 1:
+                    # Nothing left until the reset: start refilling from there
+                    self.level = -reset_in * self.capacity / 60.0
+
+class RateLimiter:
+    """
+    Request and token budgets per (provider, model), fed by response headers
+    """
+
+    def __init__(self, limits=RATE_LIMITS):
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def buckets(self, provider, model):
+        with self._lock:
+            key = (provider, model)
+            if key not in self._buckets:
+                rpm, tpm = self.limits[provider]
+                self._buckets[key] = (TokenBucket(rpm), TokenBucket(tpm))
+            return self._buckets[key]
+
+    def acquire(self, provider, model, tokens):
+        requests_bucket, tokens_bucket = self.buckets(provider, model)
+        waited = requests_bucket.acquire(1) + tokens_bucket.acquire(tokens)
+        metrics_utils.record_timing(f"llm.wait.{provider}.{model}", waited)
+        if waited > 0:
+            logging.info(f"Rate limiter delayed {provider}/{model} by {waited:.2f}s")
+        return waited
+
+    def settle(self, provider, model, reserved, used):
+        _, tokens_bucket = self.buckets(provider, model)
+        tokens_bucket.adjust(used - reserved)
+
+    def update_from_headers(self, provider, model, headers):
+        requests_bucket, tokens_bucket = self.buckets(provider, model)
+        if provider == 'anthropic':
+            requests_info = _anthropic_limit(headers, 'requests')
+            tokens_info = _anthropic_limit(headers, 'tokens')
+        else:
+            requests_info = _openai_limit(headers, 'requests')
+            tokens_info = _openai_limit(headers, 'tokens')
+        requests_bucket.sync(*requests_info)
+        tokens_bucket.sync(*tokens_info)
+
+    def penalize(self, provider, model, headers):
+        """
+        Drain the request bucket after a 429 so every caller waits for retry-after
+        """
+        requests_bucket, _ = self.buckets(provider, model)
+        retry_after = _parse_float(headers.get('retry-after')) if headers is not None else None
+        requests_bucket.sync(remaining=0, reset_in=retry_after or 60.0 / requests_bucket.capacity)
+        logging.warning(f"Rate limited by {provider}/{model}, backing off {retry_after or 'briefly'}")
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _anthropic_limit(headers, kind):
+    # anthropic-ratelimit-<kind>-reset is an RFC 3339 timestamp
+    limit = _parse_float(headers.get(f'anthropic-ratelimit-{kind}-limit'))
+    remaining = _parse_float(headers.get(f'anthropic-ratelimit-{kind}-remaining'))
+    reset_in = None
+    reset = headers.get(f'anthropic-ratelimit-{kind}-reset')
+    if reset:
+        try:
+            reset_at = datetime.fromisoformat(reset.replace('Z', '+00:00'))
+            reset_in = max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+        except ValueError:
+            pass
+    return limit, remaining, reset_in
+
+def _openai_limit(headers, kind):
+    # x-ratelimit-reset-<kind> is a duration such as "1s", "6m0s" or "20ms"
+    limit = _parse_float(headers.get(f'x-ratelimit-limit-{kind}'))
+    remaining = _parse_float(headers.get(f'x-ratelimit-remaining-{kind}'))
+    reset_in = None
+    reset = headers.get(f'x-ratelimit-reset-{kind}')
+    if reset:
+        units = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+        parts = re.findall(r'([\d.]+)(ms|h|m|s)', reset)
+        if parts:
+            reset_in = sum(float(value) * units[unit] for value, unit in parts)
+    return limit, remaining, reset_in
+
+def estimate_tokens(*parts):
+    # Rough pre-call estimate: about 4 characters per token
+    return len(json.dumps(parts, default=str)) // 4 + ESTIMATED_OUTPUT_TOKENS
+
+rate_limiter = RateLimiter()
+
+# Opt-in on-disk cache of LLM responses. Sampled calls (temperature >= 1) are
+# only cached with LLM_CACHE_SAMPLED=true, e.g. to replay a crashed run,
+# because normally every generation should be a fresh sample.
+LLM_CACHE_PATH = secrets.get('LLM_CACHE_PATH')
+LLM_CACHE_MAX_BYTES = int(secrets.get('LLM_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+LLM_CACHE_SAMPLED = secrets.get('LLM_CACHE_SAMPLED', 'false').lower() == 'true'
 
 try:
-    anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
+    llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES) if LLM_CACHE_PATH else None
 except Exception as e:
-    logging.error(f"Error initializing Anthropic client: {e}")
-    anthropic_client = None
+    logging.error(f"Error initializing LLM cache: {e}")
+    llm_cache = None
+
+def llm_cache_key(provider, params):
+    # None when the call should bypass the cache
+    if llm_cache is None:
+        return None
+    if params.get('temperature', 1) >= 1 and not LLM_CACHE_SAMPLED:
+        return None
+    return LLMCache.make_key(provider, params)
+
+# The OpenAI and Anthropic clients (and their SDKs) are loaded on first use, so
+# importing this module stays cheap and a bad key fails the call, not the import
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_openai_client():
+    """
+    Shared OpenAI client with explicit connection pool limits and timeouts (see http_pool.py)
+    """
+    client = _clients.get('openai')
+    if client is None:
+        with _clients_lock:
+            client = _clients.get('openai')
+            if client is None:
+                from openai import OpenAI, DefaultHttpxClient
+                from http_pool import llm_http_client, llm_timeout
+                client = _clients['openai'] = OpenAI(
+                    api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, timeout=llm_timeout(),
+                    http_client=llm_http_client('openai', DefaultHttpxClient),
+                )
+    return client
+
+def get_anthropic_client():
+    """
+    Shared Anthropic client with explicit connection pool limits and timeouts (see http_pool.py)
+    """
+    client = _clients.get('anthropic')
+    if client is None:
+        with _clients_lock:
+            client = _clients.get('anthropic')
+            if client is None:
+                from anthropic import Anthropic, DefaultHttpxClient
+                from http_pool import llm_http_client, llm_timeout
+                client = _clients['anthropic'] = Anthropic(
+                    api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL, timeout=llm_timeout(),
+                    http_client=llm_http_client('anthropic', DefaultHttpxClient),
+                )
+    return client
+
+def cached_system(text):
+    """
+    Wrap a system prompt that is stable across calls in a cacheable block.
+    Everything that varies per call must go in the messages after it.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+class CostMeter:
+    """
+    Adds up the estimated cost (in USD) of the LLM calls made by the current
+    thread inside the with-block
+    """
+
+    _local = threading.local()
+
+    def __enter__(self):
+        self.usd = 0.0
+        self._outer = getattr(self._local, 'meter', None)
+        self._local.meter = self
+        return self
+
+    def __exit__(self, *exc):
+        self._local.meter = self._outer
+        if self._outer is not None:
+            self._outer.usd += self.usd
+
+def record_cost(model, input_tokens, output_tokens, cache_read=0, cache_write=0, price_factor=1.0):
+    # Estimate the cost of one call and add it to the metrics and the active meter
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    usd = price_factor * (
+        input_tokens * price_in + cache_read * price_in * 0.1 + cache_write * price_in * 1.25
+        + output_tokens * price_out
+    ) / 1_000_000
+    metrics_utils.increment(f"llm.cost_usd.{model}", usd)
+    meter = getattr(CostMeter._local, 'meter', None)
+    if meter is not None:
+        meter.usd += usd
+    return usd
+
+def log_claude_usage(model, usage, price_factor=1.0):
+    # Record token usage, including prompt cache reads and writes
+    cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+    cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    record_cost(model, usage.input_tokens, usage.output_tokens, cache_read, cache_write, price_factor)
+    metrics_utils.increment(f"llm.calls.{model}")
+    metrics_utils.increment(f"llm.input_tokens.{model}", usage.input_tokens)
+    metrics_utils.increment(f"llm.output_tokens.{model}", usage.output_tokens)
+    metrics_utils.increment(f"llm.cache_read_tokens.{model}", cache_read)
+    metrics_utils.increment(f"llm.cache_write_tokens.{model}", cache_write)
+    logging.info(
+        f"{model} usage: input={usage.input_tokens} output={usage.output_tokens} "
+        f"cache_read={cache_read} cache_write={cache_write}"
+    )
+    return usage.input_tokens + usage.output_tokens + cache_read + cache_write
+
+def create_claude_message(**kwargs):
+    """
+    Call the Anthropic Messages API through the shared rate limiter
+    """
+    from anthropic import RateLimitError as AnthropicRateLimitError
+    from anthropic.types import Message as AnthropicMessage
+    model = kwargs['model']
+    cache_key = llm_cache_key('anthropic', kwargs)
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return AnthropicMessage.model_validate_json(cached)
+    reserved = estimate_tokens(kwargs.get('system'), kwargs.get('messages'))
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire('anthropic', model, reserved)
+        try:
+            raw = get_anthropic_client().messages.with_raw_response.create(**kwargs)
+        except AnthropicRateLimitError as e:
+            rate_limiter.penalize('anthropic', model, e.response.headers)
+            if attempt == RATE_LIMIT_RETRIES:
+                raise
+            continue
+        response = raw.parse()
+        rate_limiter.update_from_headers('anthropic', model, raw.headers)
+        rate_limiter.settle('anthropic', model, reserved, log_claude_usage(model, response.usage))
+        if cache_key:
+            llm_cache.put(cache_key, response.model_dump_json())
+        return response
+
+def create_openai_chat_completion(**kwargs):
+    """
+    Call the OpenAI Chat Completions API through the shared rate limiter
+    """
+    from openai import RateLimitError as OpenAIRateLimitError
+    from openai.types.chat import ChatCompletion
+    model = kwargs['model']
+    cache_key = llm_cache_key('openai', kwargs)
+    if cache_key:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return ChatCompletion.model_validate_json(cached)
+    reserved = estimate_tokens(kwargs.get('messages'))
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire('openai', model, reserved)
+        try:
+            raw = get_openai_client().chat.completions.with_raw_response.create(**kwargs)
+        except OpenAIRateLimitError as e:
+            rate_limiter.penalize('openai', model, e.response.headers)
+            if attempt == RATE_LIMIT_RETRIES:
+                raise
+            continue
+        response = raw.parse()
+        rate_limiter.update_from_headers('openai', model, raw.headers)
+        rate_limiter.settle('openai', model, reserved, response.usage.total_tokens)
+        record_cost(model, response.usage.prompt_tokens, response.usage.completion_tokens)
+        if cache_key:
+            llm_cache.put(cache_key, response.model_dump_json())
+        return response
+
+def generate_content_params(prompt, question, answer, template):
+    # Request parameters for the first-draft generation call
+    return dict(
+        model="claude-3-opus-20240229",
+        max_tokens=4096,
+        system=cached_system(prompt),
+        extra_headers=PROMPT_CACHING_HEADERS,
+        messages=[
+            {"role": "user", "content": f"""
+                Q: {question}
+                A: {answer}
+
+                Template: {template}
+            """}
+        ],
+        temperature=1
+    )
 
 def generate_content_with_claude(prompt, question, answer, template):
     # Use Anthropic's Claude to generate content
     try:
-        response = anthropic_client.messages.create(
-            model="claude-3-opus-20240229",
-            max_tokens=4096,
-            system=prompt,
-            messages=[
-                {"role": "user", "content": f"""
-                    Q: {question}
-                    A: {answer}
-
-                    Template: {template}
-                """}
-            ],
-            temperature=1
-        )
+        response = create_claude_message(**generate_content_params(prompt, question, answer, template))
         return response.content[0].text
     except Exception as e:
         logging.error(f"Error in generate_content_with_claude: {e}")
         raise
 
+def voice_and_brand_edit_params(prompt, question, answer, template, content, brand_voice):
+    # Request parameters for the brand voice edit call
+    return dict(
+        model="claude-3-opus-20240229",
+        max_tokens=4096,
+        system=cached_system(prompt),
+        extra_headers=PROMPT_CACHING_HEADERS,
+        messages=[
+            {"role": "user", "content": f"""
+                Q: {question}
+                A: {answer}
+
+                Template: {template}
+            """},
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": f"""
+                Edit the piece of content by following this client brief and tuning it to their voice and brand guidelines.
+
+                <ClientBrief>
+                {brand_voice}
+                </ClientBrief>
+                """
+             }
+        ],
+        temperature=1
+    )
+
 def voice_and_brand_edit_with_claude(prompt, question, answer, template, content, brand_voice):
     # Use Anthropic's Claude to edit content
     try:
-        response = anthropic_client.messages.create(
-            model="claude-3-opus-20240229",
-            max_tokens=4096,
-            system=prompt,
-            messages=[
-                {"role": "user", "content": f"""
-                    Q: {question}
-                    A: {answer}
-
-                    Template: {template}
-                """},
-                {"role": "assistant", "content": content},
-                {"role": "user", "content": f"""
-                    Edit the piece of content by following this client brief and tuning it to their voice and brand guidelines.
-
-                    <ClientBrief>
-                    {brand_voice}
-                    </ClientBrief>
-                    """
-                 }
-            ],
-            temperature=1
-        )
+        response = create_claude_message(**voice_and_brand_edit_params(prompt, question, answer, template, content, brand_voice))
         return response.content[0].text
     except Exception as e:
         logging.error(f"Error in voice_and_brand_edit_with_claude: {e}")
         raise
 
+def generate_and_edit_params(prompt, question, answer, template, brand_voice):
+    # Request parameters for the single-pass (draft + brand edit) call
+    return dict(
+        model="claude-3-opus-20240229",
+        max_tokens=4096,
+        system=cached_system(prompt),
+        extra_headers=PROMPT_CACHING_HEADERS,
+        messages=[
+            {"role": "user", "content": f"""
+                Q: {question}
+                A: {answer}
+
+                Template: {template}
+
+                Before answering, check your draft against this client brief and tune it to their voice and brand guidelines. Output only the final piece of content.
+
+                <ClientBrief>
+                {brand_voice}
+                </ClientBrief>
+            """}
+        ],
+        temperature=1
+    )
+
+def generate_and_edit_with_claude(prompt, question, answer, template, brand_voice):
+    # Use Anthropic's Claude to write the brand-tuned draft in a single call
+    try:
+        response = create_claude_message(**generate_and_edit_params(prompt, question, answer, template, brand_voice))
+        return response.content[0].text
+    except Exception as e:
+        logging.error(f"Error in generate_and_edit_with_claude: {e}")
+        raise
+
 def rewrite_content_to_fit_limit(content, limit=280):
     # Use OpenAI to rewrite content to fit character limit
     try:
@@ -95,7 +472,7 @@ def rewrite_content_to_fit_limit(content, limit=280):
             {'role': 'system', 'content': prompt},
             {'role': 'user', 'content': content}
         ]
-        response = openai_client.chat.completions.create(
+        response = create_openai_chat_completion(
             model='gpt-4o-mini-2024-07-18',
             messages=messages,
             max_tokens=4096,
@@ -106,22 +483,75 @@ def rewrite_content_to_fit_limit(content, limit=280):
         logging.error(f"Error in rewrite_content_to_fit_limit: {e}")
         raise
 
+def screen_content_params(content, sample_content):
+    # Request parameters for screening one post
+    messages = [
+        {'role': 'user', 'content': f"Post to review:{content}"}
+    ]
+    return dict(
+        model="claude-3-5-sonnet-20241022",
+        system=cached_system(f"""
+        You are an expert copy editor tasked with reviewing posts for brand, voice, style, or quality. You will be given a post to review and short form content examples of what success looks like. Your goal is to provide specific, concise feedback on the post.
+
+        Here are the short form examples of successful content:  
+
+        {sample_content}
+
+        When reviewing the post, follow this process:
+
+        1. Carefully read the post and compare it to the short form examples.
+
+        2. Determine if the post meets the standards set by the examples in terms of brand, voice, style, and quality.
+
+        3. Prepare your reasoning for why the post does or does not meet these standards.
+
+        4. If an update is warranted, prepare a suggestion for new copy.
+
+        Provide your review in the following format:
+
+        {{Yes or No}}
+
+        • [Your bullet point reasoning why]
+
+        Suggested copy: [If the post is salvageable, provide suggested new copy here] [do not try to save if too far gone; leave out this line entirely]
+
+        Remember to be specific and concise in your feedback. Your review should help improve the post's alignment with the successful short form examples provided.
+        """),
+        extra_headers=PROMPT_CACHING_HEADERS,
+        messages=messages,
+        max_tokens=4096,
+        temperature=0.2,
+    )
+
 def ai_screen_content(content, sample_content):
     # Use Anthropic to screen content for brand voice alignment
     try:
-        messages = [
-            {'role': 'user', 'content': f"Post to review:{content}"}
-        ]
-        response = anthropic_client.messages.create(
+        response = create_claude_message(**screen_content_params(content, sample_content))
+        # Return the response text
+        return response.content[0].text
+    except Exception as e:
+        logging.error(f"Error in ai_screen_content: {e}")
+        raise
+
+def ai_screen_contents_batch(contents, sample_content):
+    """
+    Screen several posts in one call. Returns one dict per post with
+    'approved', 'reasoning', 'suggested_copy' and 'screening_result' (the review
+    in the single-post text format). Falls back to one call per post if the
+    batch output cannot be parsed.
+    """
+    posts = "\n\n".join(f'<post id="{i + 1}">\n{content}\n</post>' for i, content in enumerate(contents))
+    try:
+        response = create_claude_message(
             model="claude-3-5-sonnet-20241022",
-            system=f"""
-            You are an expert copy editor tasked with reviewing posts for brand, voice, style, or quality. You will be given a post to review and short form content examples of what success looks like. Your goal is to provide specific, concise feedback on the post.
+            system=cached_system(f"""
+            You are an expert copy editor tasked with reviewing posts for brand, voice, style, or quality. You will be given several posts to review and short form content examples of what success looks like. Your goal is to provide specific, concise feedback on each post.
 
-            Here are the short form examples of successful content:  
+            Here are the short form examples of successful content:
 
             {sample_content}
 
-            When reviewing the post, follow this process:
+            When reviewing the posts, follow this process for each post independently:
 
             1. Carefully read the post and compare it to the short form examples.
 
@@ -129,27 +559,159 @@ def ai_screen_content(content, sample_content):
 
             3. Prepare your reasoning for why the post does or does not meet these standards.
 
-            4. If an update is warranted, prepare a suggestion for new copy.
-
-            Provide your review in the following format:
-
-            {{Yes or No}}
+            4. If an update is warranted and the post is salvageable, prepare a suggestion for new copy. Do not try to save it if it is too far gone.
 
-            • [Your bullet point reasoning why]
+            Respond with only a JSON array containing one object per post, in the same order, in this format:
 
-            [If the post is salvageable, provide suggested new copy here] [do not try to save if too far gone]
+            [{{"post": 1, "verdict": "Yes" or "No", "reasoning": ["bullet point", ...], "suggested_copy": "new copy" or null}}]
 
-            Remember to be specific and concise in your feedback. Your review should help improve the post's alignment with the successful short form examples provided.
-            """,
-            messages=messages,
+            Remember to be specific and concise in your feedback.
+            """),
+            extra_headers=PROMPT_CACHING_HEADERS,
+            messages=[{'role': 'user', 'content': f"Posts to review:\n\n{posts}"}],
             max_tokens=4096,
             temperature=0.2,
         )
-        # Return the response text
-        return response.content[0].text
+        reviews = parse_batch_screening(response.content[0].text, len(contents))
+        metrics_utils.increment('screening.batched_posts', len(contents))
+        return reviews
     except Exception as e:
-        logging.error(f"Error in ai_screen_content: {e}")
-        raise
+        logging.warning(f"Batch screening failed, screening {len(contents)} posts one by one: {e}")
+        metrics_utils.increment('screening.batch_fallbacks')
+        return [parse_screening_result(ai_screen_content(content, sample_content)) for content in contents]
+
+class ScreeningBatcher:
+    """
+    Collects drafts screened concurrently for the same user and reviews them
+    together with ai_screen_contents_batch. A batch is sent when batch_size
+    drafts are waiting or the oldest has waited max_wait seconds.
+    With batch_size 1 every draft is screened on its own.
+    """
+
+    def __init__(self, sample_content, batch_size, max_wait=2.0):
+        self.sample_content = sample_content
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._pending = []
+
+    def screen(self, content):
+        """
+        Screen one draft, blocking until its batch has been reviewed
+        """
+        if self.batch_size == 1:
+            return parse_screening_result(ai_screen_content(content, self.sample_content))
+
+        slot = {'done': threading.Event(), 'review': None, 'error': None}
+        with self._lock:
+            self._pending.append((content, slot))
+            batch = self._take() if len(self._pending) >= self.batch_size else None
+        if batch is None and not slot['done'].wait(self.max_wait):
+            # Waited long enough: send whatever is pending, if nobody else did
+            with self._lock:
+                batch = self._take() if any(pending is slot for _, pending in self._pending) else None
+        if batch:
+            self._review(batch)
+        slot['done'].wait()
+        if slot['error'] is not None:
+            raise slot['error']
+        return slot['review']
+
+    def _take(self):
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        return batch
+
+    def _review(self, batch):
+        contents = [content for content, _ in batch]
+        try:
+            if len(contents) == 1:
+                reviews = [parse_screening_result(ai_screen_content(contents[0], self.sample_content))]
+            else:
+                reviews = ai_screen_contents_batch(contents, self.sample_content)
+            for (_, slot), review in zip(batch, reviews):
+                slot['review'] = review
+        except Exception as e:
+            for _, slot in batch:
+                slot['error'] = e
+        finally:
+            for _, slot in batch:
+                slot['done'].set()
+
+def parse_batch_screening(text, expected):
+    """
+    Parse the JSON array returned by batch screening, or raise ValueError
+    """
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end == -1:
+        raise ValueError("No JSON array in batch screening output")
+    items = json.loads(text[start:end + 1])
+    if not isinstance(items, list) or len(items) != expected:
+        raise ValueError(f"Expected {expected} reviews, got {len(items) if isinstance(items, list) else 'none'}")
+
+    reviews = [None] * expected
+    for position, item in enumerate(items):
+        index = int(item.get('post', position + 1)) - 1
+        if not 0 <= index < expected or reviews[index] is not None:
+            raise ValueError(f"Unexpected post number in batch screening output: {item.get('post')}")
+        verdict = str(item.get('verdict', '')).strip()
+        if verdict.lower() not in ('yes', 'no'):
+            raise ValueError(f"Unexpected verdict in batch screening output: {verdict}")
+        reasoning = item.get('reasoning') or []
+        if isinstance(reasoning, str):
+            reasoning = [reasoning]
+        suggested_copy = item.get('suggested_copy') or None
+
+        # Keep the Screening Result field in the same format as single screening
+        screening_result = verdict + "\n\n" + "\n".join(f"• {reason}" for reason in reasoning)
+        if suggested_copy:
+            screening_result += "\n\nSuggested copy: " + suggested_copy
+        reviews[index] = {
+            'approved': verdict.lower() == 'yes',
+            'reasoning': reasoning,
+            'suggested_copy': suggested_copy,
+            'screening_result': screening_result,
+        }
+    return reviews
+
+# Label in front of the copy the screener suggests for a rejected post
+SUGGESTED_COPY_LABEL = re.compile(r'^\W*suggested( new)? copy\W*:[*_]*\s*', re.IGNORECASE)
+
+def parse_screening_result(screening_result):
+    """
+    Split a single-post review into verdict, bullet reasoning and suggested
+    copy. Only text behind a "Suggested copy:" label counts as suggested copy,
+    so closing remarks are never mistaken for a new post.
+    """
+    lines = screening_result.strip().splitlines()
+    reasoning = []
+    suggested = None
+    for line in lines[1:]:
+        stripped = line.strip()
+        if suggested is not None:
+            suggested.append(line.rstrip())
+            continue
+        label = SUGGESTED_COPY_LABEL.match(stripped)
+        if label:
+            suggested = [stripped[label.end():]]
+        elif stripped.startswith(('•', '-', '*')):
+            reasoning.append(stripped.lstrip('•-* ').strip())
+    suggested_copy = "\n".join(suggested).strip() if suggested else None
+    return {
+        'approved': is_screening_approved(screening_result),
+        'reasoning': reasoning,
+        'suggested_copy': suggested_copy or None,
+        'screening_result': screening_result,
+    }
+
+def is_screening_approved(screening_result):
+    # The screener answers "Yes" or "No" on the first line
+    lines = screening_result.strip().splitlines()
+    if lines:
+        first_line = lines[0].strip().lower()
+        if 'yes' in first_line:
+            return True
+    return False
 
 def generate_content_prompt(brand_voice):
     # Build the prompt for content generation
@@ -201,7 +763,7 @@ def compare_brand_voice_and_sample_content(brand_voice, sample_content):
         messages = [
             {'role': 'user', 'content': f"brand voice:{brand_voice}, content examples: {sample_content}"}
         ]
-        response = anthropic_client.messages.create(
+        response = create_claude_message(
             model="claude-3-5-sonnet-20241022",
             system=f"""
                 You are an AI designed to evaluate whether a set of content examples collectively aligns with a specified brand voice. The brand voice will be described as a variable. Your task is to analyze the overall tone, style, and messaging in the content examples and determine if they are consistent with the described brand voice.
@@ -0,0 +1,63 @@
+# airtable_api.py
+#
+# The pyairtable Api used by AirtableClient. Kept apart from airtable_utils so
+# pyairtable and requests are only imported when a client is first built.
+
+from urllib.parse import unquote, urlparse
+from pyairtable import Api, retry_strategy
+from requests.exceptions import HTTPError
+import metrics_utils
+from http_pool import mount_pooled_adapter, AIRTABLE_POOL_SIZE, AIRTABLE_CONNECT_TIMEOUT, AIRTABLE_READ_TIMEOUT
+
+
+class RateLimitedApi(Api):
+    """
+    pyairtable Api whose every HTTP request (including each page of all())
+    waits on the base limiter and records its wait time per table operation.
+    A 429 slows the limiter down and is retried up to rate_limit_retries times.
+    """
+
+    def __init__(self, api_key, limiter, rate_limit_retries, **kwargs):
+        # 429s are left to the limiter; other transient errors are still retried
+        kwargs.setdefault('retry_strategy', retry_strategy(status_forcelist=(500, 502, 503, 504)))
+        kwargs.setdefault('timeout', (AIRTABLE_CONNECT_TIMEOUT, AIRTABLE_READ_TIMEOUT))
+        super().__init__(api_key, **kwargs)
+        # One keep-alive pool shared by every table of the base
+        mount_pooled_adapter(self.session, 'airtable', AIRTABLE_POOL_SIZE, kwargs['retry_strategy'] or 0)
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+
+    @staticmethod
+    def operation_name(method, url):
+        # .../v0/<base>/<table>[/<record id> | /listRecords]
+        parts = urlparse(url).path.split('/')
+        table = unquote(parts[3]) if len(parts) > 3 else 'unknown'
+        method = method.upper()
+        if method == 'GET':
+            operation = 'get' if len(parts) > 4 else 'list'
+        elif method == 'POST':
+            operation = 'list' if parts[-1] == 'listRecords' else 'create'
+        elif method in ('PATCH', 'PUT'):
+            operation = 'update'
+        else:
+            operation = method.lower()
+        return f"{table}.{operation}"
+
+    def request(self, method, url, *args, **kwargs):
+        operation = self.operation_name(method, url)
+        for attempt in range(self.rate_limit_retries + 1):
+            waited = self.limiter.acquire()
+            metrics_utils.record_timing(f"airtable.wait.{operation}", waited)
+            metrics_utils.increment(f"airtable.calls.{operation}")
+            try:
+                result = super().request(method, url, *args, **kwargs)
+            except HTTPError as e:
+                if e.response is not None and e.response.status_code == 429:
+                    metrics_utils.increment(f"airtable.throttled.{operation}")
+                    self.limiter.on_throttled()
+                    if attempt < self.rate_limit_retries:
+                        continue
+                raise
+            self.limiter.on_success()
+            metrics_utils.set_gauge('airtable.rate', self.limiter.rate)
+            return result
@@ -1,9 +1,23 @@
 # airtable_utils.py
 
+import atexit
+import fcntl
+import json
 import os
-from pyairtable import Table
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from dotenv import dotenv_values
 import logging
+import metrics_utils
+from combination_sampler import CombinationSampler
+from approval_bandit import ApprovalBandit
+from similarity_index import SimHashIndex, simhash, SIMILARITY_MAX_DISTANCE
 
 # Load environment variables from .env file
 secrets = dotenv_values(".env")
@@ -12,6 +26,9 @@ secrets = dotenv_values(".env")
 AIRTABLE_PERSONAL_TOKEN = secrets.get("AIRTABLE_PERSONAL_TOKEN")
 BASE_ID = secrets.get("AIRTABLE_BASE_ID")
 
+# Airtable API root, overridable to point at a local fake (see benchmarks/)
+AIRTABLE_ENDPOINT_URL = secrets.get("AIRTABLE_ENDPOINT_URL", "https://api.airtable.com")
+
 # Table names in Airtable (Replace with your actual table names)
 GENERATION_REQUESTS_TABLE_NAME = 'Generation Form Request'
 GENERATED_CONTENT_TABLE_NAME = 'Python Automation Generated Content'
@@ -20,6 +37,850 @@ TEMPLATES_TABLE_NAME = 'Templates'
 SOURCES_TABLE_NAME = 'Sources'
 QA_PAIRS_TABLE_NAME = 'QA Pairs'
 
+# Local SQLite mirror of the Users, Templates, Sources and QA Pairs tables, next
+# to this module unless overridden (e.g. by the benchmarks). Reads start a
+# background sync of the rows modified since the last one every
+# MIRROR_SYNC_INTERVAL seconds and sync inline once the copy is older than
+# MIRROR_MAX_STALENESS. Deleted rows are looked for every MIRROR_DELETE_CHECK_INTERVAL.
+TABLE_MIRROR_PATH = secrets.get(
+    "TABLE_MIRROR_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'table_mirror.sqlite3')
+)
+MIRROR_SYNC_INTERVAL = int(secrets.get("MIRROR_SYNC_INTERVAL", 60))
+MIRROR_MAX_STALENESS = int(secrets.get("MIRROR_MAX_STALENESS", 600))
+MIRROR_DELETE_CHECK_INTERVAL = int(secrets.get("MIRROR_DELETE_CHECK_INTERVAL", 3600))
+
+# Template cache size (number of distinct filter combinations)
+TEMPLATE_CACHE_SIZE = int(secrets.get("TEMPLATE_CACHE_SIZE", 128))
+
+# How often the similarity index pulls in drafts saved by other processes (in seconds)
+SIMILARITY_INDEX_TTL = int(secrets.get("SIMILARITY_INDEX_TTL", 300))
+
+# Used (QA pair, template) combinations per user and source set, next to this
+# module unless overridden (e.g. by the benchmarks)
+COMBINATION_SAMPLER_PATH = secrets.get(
+    "COMBINATION_SAMPLER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'used_combinations.sqlite3')
+)
+
+# Screening outcomes per user and template / QA source, used to favour the
+# templates and sources a user's drafts get approved with. BANDIT_EXPLORATION is
+# the share of picks made uniformly at random so every template keeps being tried.
+APPROVAL_STATS_PATH = secrets.get(
+    "APPROVAL_STATS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'approval_stats.sqlite3')
+)
+BANDIT_EXPLORATION = float(secrets.get("BANDIT_EXPLORATION", 0.1))
+
+# Record IDs per OR(RECORD_ID()=...) lookup, to stay under the URL length limit
+RECORD_ID_CHUNK = 50
+
+# Airtable allows 5 requests per second per base, shared by every table and
+# thread. A 429 locks the base out for 30 seconds.
+AIRTABLE_MAX_RPS = float(secrets.get("AIRTABLE_MAX_RPS", 5))
+AIRTABLE_MIN_RPS = 0.5
+AIRTABLE_PENALTY_SECONDS = 30
+AIRTABLE_RATE_LIMIT_RETRIES = 3
+
+# Generated drafts are written in the background in batches of up to 10 records
+# (Airtable's batch limit), at least every GENERATED_CONTENT_FLUSH_INTERVAL
+# seconds. Batches that fail with a transient error (429, 5xx, connection) are
+# appended to the spill file and retried on the next successful flush or at the
+# next start. A batch Airtable rejects (any other 4xx) is retried one record at
+# a time, and the records rejected again go to REJECTED_DRAFTS_FILE with the
+# error instead of being retried forever. The files may be shared by several
+# processes; they take turns through an flock on UNSAVED_DRAFTS_FILE + '.lock'.
+GENERATED_CONTENT_BATCH_SIZE = 10
+GENERATED_CONTENT_FLUSH_INTERVAL = float(secrets.get("GENERATED_CONTENT_FLUSH_INTERVAL", 5))
+UNSAVED_DRAFTS_FILE = secrets.get(
+    "UNSAVED_DRAFTS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unsaved_drafts.jsonl')
+)
+REJECTED_DRAFTS_FILE = secrets.get(
+    "REJECTED_DRAFTS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rejected_drafts.jsonl')
+)
+
+# Overlap applied to the last-modified watermark to absorb clock skew with Airtable
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+
+def format_airtable_time(dt):
+    """
+    Format a datetime the way Airtable reports times (ISO 8601, UTC, milliseconds)
+    """
+    return dt.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+def qa_pair_source(record):
+    # First Source_ID of a QA pair (a plain value or a lookup list), or None
+    value = record['fields'].get('Source_ID')
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value) if value is not None else None
+
+class AdaptiveRateLimiter:
+    """
+    Spaces out calls to one Airtable base with additive-increase /
+    multiplicative-decrease: each success nudges the rate back up towards the
+    ceiling, each 429 halves it and pauses every caller for the penalty window.
+    """
+
+    def __init__(self, max_rate=AIRTABLE_MAX_RPS, min_rate=AIRTABLE_MIN_RPS, increase=0.05):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.rate = max_rate
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        """
+        Wait for the next free slot. Returns the seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttled(self, penalty=AIRTABLE_PENALTY_SECONDS):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._next_slot = max(self._next_slot, time.monotonic() + penalty)
+        logging.warning(f"Airtable rate limit hit, pausing {penalty}s and slowing to {self.rate:.2f} req/s")
+
+
+# One limiter per base, shared by every AirtableClient in the process
+_base_limiters = {}
+_base_limiters_lock = threading.Lock()
+
+def get_base_limiter(base_id):
+    with _base_limiters_lock:
+        if base_id not in _base_limiters:
+            _base_limiters[base_id] = AdaptiveRateLimiter()
+        return _base_limiters[base_id]
+
+
+class WriteBehindQueue:
+    """
+    Collects records for one table and creates them in batches on a
+    background thread, so callers never wait on Airtable I/O.
+
+    flush() blocks until everything queued before the call has been written
+    (or spilled to the local file, or dead-lettered if Airtable rejected it).
+    close() flushes and stops the thread and runs automatically at
+    interpreter exit; records put after that go straight to the spill file.
+    """
+
+    def __init__(self, table, batch_size=GENERATED_CONTENT_BATCH_SIZE,
+                 flush_interval=GENERATED_CONTENT_FLUSH_INTERVAL, spill_path=UNSAVED_DRAFTS_FILE,
+                 rejected_path=REJECTED_DRAFTS_FILE):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.rejected_path = rejected_path
+        self._condition = threading.Condition()
+        self._buffer = []
+        self._enqueued = 0
+        self._done = 0
+        self._flush_requested = False
+        self._closed = False
+        self._spill_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        self._replay_spill()
+
+    def put(self, fields):
+        with self._condition:
+            if not self._closed:
+                self._buffer.append(fields)
+                self._enqueued += 1
+                if len(self._buffer) >= self.batch_size:
+                    self._condition.notify_all()
+                return
+        # The writer thread has stopped: keep the record for the next start
+        logging.warning(f"Write-behind queue is closed, spilling a draft to {self.spill_path}")
+        metrics_utils.increment('drafts.spilled')
+        self._spill([fields])
+
+    def flush(self, timeout=None):
+        """
+        Wait until every record queued so far is written or spilled
+        """
+        with self._condition:
+            target = self._enqueued
+            self._flush_requested = True
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: self._done >= target, timeout=timeout)
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._closed or self._flush_requested or len(self._buffer) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                if not self._buffer:
+                    self._flush_requested = False
+                finished = self._closed and not batch
+            if finished:
+                return
+            if batch:
+                self._write(batch)
+                with self._condition:
+                    self._done += len(batch)
+                    self._condition.notify_all()
+
+    @staticmethod
+    def _rejected(error):
+        # A 4xx other than 429 is Airtable refusing the records themselves; retrying won't help
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status is not None and 400 <= status < 500 and status != 429
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            self.table.batch_create(batch)
+        except Exception as e:
+            if self._rejected(e):
+                logging.warning(f"Airtable rejected a batch of {len(batch)} generated drafts, "
+                                f"saving them one at a time: {e}")
+                self._write_each(batch)
+            else:
+                logging.error(f"Error saving {len(batch)} generated drafts, spilling to {self.spill_path}: {e}")
+                metrics_utils.increment('drafts.spilled', len(batch))
+                self._spill(batch)
+            return
+        metrics_utils.increment('drafts.saved', len(batch))
+        metrics_utils.record_timing('drafts.batch_write', time.monotonic() - started)
+        # Airtable is reachable again: retry anything spilled earlier
+        if os.path.exists(self.spill_path):
+            self._replay_spill()
+
+    def _write_each(self, batch):
+        for fields in batch:
+            try:
+                self.table.batch_create([fields])
+            except Exception as e:
+                if self._rejected(e):
+                    logging.error(f"Airtable rejected a generated draft, writing it to {self.rejected_path}: {e}")
+                    metrics_utils.increment('drafts.rejected')
+                    self._dead_letter(fields, e)
+                else:
+                    logging.error(f"Error saving a generated draft, spilling to {self.spill_path}: {e}")
+                    metrics_utils.increment('drafts.spilled')
+                    self._spill([fields])
+                continue
+            metrics_utils.increment('drafts.saved')
+
+    @contextmanager
+    def _locked_spill(self):
+        # Exclusive use of the spill file among the threads of this process and other processes
+        with self._spill_lock:
+            with open(self.spill_path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _spill(self, batch):
+        try:
+            with self._locked_spill():
+                with open(self.spill_path, 'a') as file:
+                    for fields in batch:
+                        file.write(json.dumps(fields) + '\n')
+        except Exception as e:
+            logging.error(f"Error spilling {len(batch)} drafts to {self.spill_path}: {e}")
+
+    def _dead_letter(self, fields, error):
+        entry = {
+            'rejected_at': datetime.now(timezone.utc).isoformat(),
+            'error': str(error),
+            'fields': fields,
+        }
+        try:
+            with self._locked_spill():
+                with open(self.rejected_path, 'a') as file:
+                    file.write(json.dumps(entry) + '\n')
+        except Exception as e:
+            logging.error(f"Error writing a rejected draft to {self.rejected_path}: {e}")
+
+    def _replay_spill(self):
+        try:
+            with self._locked_spill():
+                if not os.path.exists(self.spill_path):
+                    return
+                with open(self.spill_path, 'r') as file:
+                    records = [json.loads(line) for line in file if line.strip()]
+                os.remove(self.spill_path)
+        except Exception as e:
+            logging.error(f"Error reading spilled drafts from {self.spill_path}: {e}")
+            return
+        if records:
+            logging.info(f"Re-queueing {len(records)} spilled drafts")
+            with self._condition:
+                self._buffer.extend(records)
+                self._enqueued += len(records)
+                self._condition.notify_all()
+
+
+class RecordLookup:
+    """
+    Resolves record IDs of one table in chunked OR(RECORD_ID()=...) queries,
+    chunk_size IDs per request. IDs requested again while a query for them is
+    running wait for that query instead of sending their own (single-flight).
+    """
+
+    def __init__(self, table, fields=None, chunk_size=RECORD_ID_CHUNK):
+        self.table = table
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def get_many(self, record_ids):
+        """
+        Return {record_id: record} for the IDs that exist
+        """
+        flights = {}
+        owned = []
+        with self._lock:
+            for record_id in dict.fromkeys(record_ids):
+                flight = self._in_flight.get(record_id)
+                if flight is None:
+                    flight = self._in_flight[record_id] = Future()
+                    owned.append(record_id)
+                else:
+                    metrics_utils.increment('airtable.lookup.coalesced')
+                flights[record_id] = flight
+
+        for start in range(0, len(owned), self.chunk_size):
+            chunk = owned[start:start + self.chunk_size]
+            try:
+                formula = "OR(" + ",".join(f"RECORD_ID()='{record_id}'" for record_id in chunk) + ")"
+                if self.fields:
+                    records = self.table.all(formula=formula, fields=self.fields)
+                else:
+                    records = self.table.all(formula=formula)
+                found = {record['id']: record for record in records}
+                error = None
+            except Exception as e:
+                error = e
+            metrics_utils.increment('airtable.lookup.queries')
+            metrics_utils.increment('airtable.lookup.ids', len(chunk))
+            with self._lock:
+                for record_id in chunk:
+                    self._in_flight.pop(record_id, None)
+            for record_id in chunk:
+                if error is not None:
+                    flights[record_id].set_exception(error)
+                else:
+                    flights[record_id].set_result(found.get(record_id))
+
+        results = {}
+        for record_id, flight in flights.items():
+            record = flight.result()
+            if record is not None:
+                results[record_id] = record
+        return results
+
+
+class TableMirror:
+    """
+    Local copy of one Airtable table, kept in SQLite so it survives restarts.
+
+    The first sync loads the whole table. Later syncs pull only the rows
+    modified since a LAST_MODIFIED_TIME() watermark, and every
+    delete_check_interval the record IDs are listed with only id_field, which
+    should be a short field such as a name, to drop rows deleted in Airtable. Reads are served from memory: they start a
+    background sync once sync_interval has passed and sync inline when the copy
+    is older than max_staleness. If Airtable cannot be reached the last copy is
+    served. version changes whenever the rows change.
+    """
+
+    def __init__(self, table, name, path, id_field, sync_interval=MIRROR_SYNC_INTERVAL,
+                 max_staleness=MIRROR_MAX_STALENESS, delete_check_interval=MIRROR_DELETE_CHECK_INTERVAL):
+        self.table = table
+        self.name = name
+        self.path = path
+        self.id_field = id_field
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.delete_check_interval = delete_check_interval
+        self.version = 0
+        self._sorted = []
+        self._sorted_version = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._records = {}
+        self._watermark = None
+        self._last_sync = 0.0
+        self._last_delete_check = 0.0
+        self._syncer = None
+        self._lookup = RecordLookup(table)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mirror_records (
+                    table_name TEXT NOT NULL,
+                    record_id TEXT NOT NULL,
+                    created_time TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    PRIMARY KEY (table_name, record_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS mirror_state (
+                    table_name TEXT PRIMARY KEY,
+                    watermark TEXT NOT NULL,
+                    last_sync REAL NOT NULL,
+                    last_delete_check REAL NOT NULL
+                )
+            """)
+        self._load()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _load(self):
+        # Start from the stored copy, if an earlier process left one
+        try:
+            with self._connect() as conn:
+                state = conn.execute(
+                    "SELECT watermark, last_sync, last_delete_check FROM mirror_state WHERE table_name = ?", (self.name,)
+                ).fetchone()
+                if state is None:
+                    return
+                rows = conn.execute(
+                    "SELECT record_id, created_time, fields FROM mirror_records WHERE table_name = ?", (self.name,)
+                ).fetchall()
+            self._records = {
+                record_id: {'id': record_id, 'createdTime': created_time, 'fields': json.loads(fields)}
+                for record_id, created_time, fields in rows
+            }
+            self._watermark, self._last_sync, self._last_delete_check = state
+            self.version += 1
+            logging.info(f"Loaded {len(rows)} {self.name} rows from the local mirror")
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f"Error reading the {self.name} mirror: {e}")
+
+    def _store(self, records, deleted, replace_all, watermark, synced_at):
+        with self._connect() as conn:
+            if replace_all:
+                conn.execute("DELETE FROM mirror_records WHERE table_name = ?", (self.name,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO mirror_records (table_name, record_id, created_time, fields) VALUES (?, ?, ?, ?)",
+                [(self.name, r['id'], r['createdTime'], json.dumps(r['fields'])) for r in records],
+            )
+            conn.executemany(
+                "DELETE FROM mirror_records WHERE table_name = ? AND record_id = ?",
+                [(self.name, record_id) for record_id in deleted],
+            )
+            if watermark is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO mirror_state (table_name, watermark, last_sync, last_delete_check) VALUES (?, ?, ?, ?)",
+                    (self.name, watermark, synced_at, self._last_delete_check),
+                )
+
+    def _sync(self):
+        now = time.time()
+        started_at = datetime.now(timezone.utc)
+        deleted = []
+        replace_all = self._watermark is None
+        with metrics_utils.timed(f'mirror.{self.name}.sync'):
+            if replace_all:
+                records = self.table.all()
+                self._last_delete_check = now
+            else:
+                formula = f"IS_AFTER(LAST_MODIFIED_TIME(), '{self._watermark}')"
+                records = self.table.all(formula=formula)
+                if now - self._last_delete_check >= self.delete_check_interval:
+                    # Rows created since the delta query are listed but not local yet, so they are kept
+                    live = {record['id'] for record in self.table.all(fields=[self.id_field])}
+                    with self._lock:
+                        deleted = [record_id for record_id in self._records if record_id not in live]
+                    self._last_delete_check = now
+            watermark = format_airtable_time(started_at - WATERMARK_OVERLAP)
+            self._store(records, deleted, replace_all, watermark, now)
+
+        with self._lock:
+            if replace_all:
+                self._records = {}
+            for record in records:
+                self._records[record['id']] = record
+            for record_id in deleted:
+                self._records.pop(record_id, None)
+            if replace_all or records or deleted:
+                self.version += 1
+            rows = len(self._records)
+        self._watermark = watermark
+        self._last_sync = now
+        metrics_utils.increment(f'mirror.{self.name}.synced', len(records))
+        metrics_utils.increment(f'mirror.{self.name}.deleted', len(deleted))
+        metrics_utils.set_gauge(f'mirror.{self.name}.rows', rows)
+        if replace_all or records or deleted:
+            logging.info(f"Synced the {self.name} mirror: {len(records)} rows changed, {len(deleted)} deleted, {rows} total")
+
+    def _background_sync(self):
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._sync()
+        except Exception as e:
+            logging.error(f"Error syncing the {self.name} mirror: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def refresh(self, force=False):
+        """
+        Sync inline if the copy is older than max_staleness (or when forced),
+        otherwise start a background sync once sync_interval has passed
+        """
+        requested_at = time.time()
+        if force or self._watermark is None or requested_at - self._last_sync >= self.max_staleness:
+            with self._sync_lock:
+                # Skip if a sync started while this thread waited for the lock
+                threshold = requested_at if force else time.time() - self.max_staleness
+                if self._watermark is None or self._last_sync < threshold:
+                    try:
+                        self._sync()
+                    except Exception as e:
+                        if self._watermark is None:
+                            raise
+                        logging.error(f"Error syncing the {self.name} mirror, serving the local copy: {e}")
+        elif requested_at - self._last_sync >= self.sync_interval:
+            if self._syncer is None or not self._syncer.is_alive():
+                self._syncer = threading.Thread(target=self._background_sync, name=f'mirror-{self.name}', daemon=True)
+                self._syncer.start()
+
+    def current_version(self, force_refresh=False):
+        """
+        Refresh as snapshot() does but return only the version, so callers
+        can skip reading the rows when nothing has changed
+        """
+        self.refresh(force_refresh)
+        return self.version
+
+    def snapshot(self, force_refresh=False):
+        """
+        The version and every row of the table, in creation order. The list is
+        sorted once per version and shared between callers, who must not modify it.
+        """
+        self.refresh(force_refresh)
+        with self._lock:
+            if self._sorted_version != self.version:
+                self._sorted = sorted(self._records.values(), key=lambda record: record['createdTime'])
+                self._sorted_version = self.version
+            return self.version, self._sorted
+
+    def get_many(self, record_ids, force_refresh=False):
+        """
+        {record_id: record} for the given IDs. Rows created since the last sync
+        are fetched from Airtable in one batched lookup and kept.
+        """
+        self.refresh(force_refresh)
+        with self._lock:
+            found = {record_id: self._records[record_id] for record_id in record_ids if record_id in self._records}
+        missing = [record_id for record_id in record_ids if record_id not in found]
+        if missing:
+            fetched = self._lookup.get_many(missing)
+            if fetched:
+                self._store(list(fetched.values()), [], False, None, None)
+                with self._lock:
+                    self._records.update(fetched)
+                    self.version += 1
+                found.update(fetched)
+            metrics_utils.increment(f'mirror.{self.name}.read_through', len(missing))
+        return found
+
+    def get(self, record_id, force_refresh=False):
+        """
+        One row, or None if it does not exist
+        """
+        return self.get_many([record_id], force_refresh).get(record_id)
+
+
+class QAPairIndex:
+    """
+    Per-process index of the QA pairs in the table mirror keyed by Source_ID,
+    rebuilt whenever the mirror has changed. Random picks are served from memory.
+    """
+
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self._lock = threading.Lock()
+        self._records = {}
+        self._by_source = {}
+        self._all_ids = []
+        self._version = None
+
+    @staticmethod
+    def _source_keys(record):
+        # Source_ID can come back as a plain value or as a lookup list
+        value = record['fields'].get('Source_ID')
+        if value is None:
+            return []
+        if isinstance(value, list):
+            return [str(v) for v in value]
+        return [str(value)]
+
+    def refresh(self, force=False):
+        """
+        Rebuild the index if the mirror has changed
+        """
+        if self.mirror.current_version(force) == self._version:
+            return
+        version, records = self.mirror.snapshot()
+        with self._lock:
+            if version == self._version:
+                return
+            self._records = {record['id']: record for record in records}
+            self._all_ids = list(self._records)
+            self._by_source = {}
+            for record in records:
+                for source in self._source_keys(record):
+                    self._by_source.setdefault(source, []).append(record['id'])
+            self._version = version
+
+    def pairs(self, source_ids=None):
+        """
+        Return every QA pair of the given sources (or of all sources)
+        """
+        self.refresh()
+        with self._lock:
+            if not source_ids:
+                return [self._records[record_id] for record_id in self._all_ids]
+            ids = []
+            for source in dict.fromkeys(str(s) for s in source_ids):
+                ids.extend(self._by_source.get(source, ()))
+            return [self._records[record_id] for record_id in dict.fromkeys(ids)]
+
+    def random_pair(self, source_ids=None):
+        """
+        Return a random QA pair from the given sources (or from all sources)
+        """
+        self.refresh()
+        with self._lock:
+            if not source_ids:
+                if not self._all_ids:
+                    return None
+                return self._records[random.choice(self._all_ids)]
+            buckets = [self._by_source[str(s)] for s in dict.fromkeys(source_ids) if str(s) in self._by_source]
+            total = sum(len(bucket) for bucket in buckets)
+            if not total:
+                return None
+            # Pick uniformly across all matching rows without building a combined list
+            index = random.randrange(total)
+            for bucket in buckets:
+                if index < len(bucket):
+                    return self._records[bucket[index]]
+                index -= len(bucket)
+
+def airtable_text(value):
+    # A field value as an Airtable formula compares it: lookups and
+    # multi-selects as comma-joined text, empty fields as ''
+    if isinstance(value, list):
+        return ', '.join(str(v) for v in value)
+    if value is None:
+        return ''
+    return str(value)
+
+def template_matches(record, content_format=None, tags=None, category=None):
+    """
+    Local equivalent of the template filter formula:
+    AND({Content Format}=format, {AAAA Category}=category, OR({Tag}=tag, ...))
+    """
+    fields = record['fields']
+    if content_format and airtable_text(fields.get('Content Format')) != content_format:
+        return False
+    if category and airtable_text(fields.get('AAAA Category')) != category:
+        return False
+    if tags and airtable_text(fields.get('Tag')) not in tags:
+        return False
+    return True
+
+class TemplateCache:
+    """
+    LRU cache of template lists keyed by (content format, tags, category),
+    filtered from the table mirror. Entries are dropped whenever the mirror
+    has changed, since an edit can affect any key.
+    """
+
+    def __init__(self, mirror, max_size=TEMPLATE_CACHE_SIZE):
+        self.mirror = mirror
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+
+    @staticmethod
+    def make_key(content_format, tags=None, category=None):
+        return (content_format, tuple(sorted(tags)) if tags else (), category)
+
+    def get(self, content_format, tags=None, category=None, force_refresh=False):
+        """
+        Return the templates matching the filters
+        """
+        key = self.make_key(content_format, tags, category)
+        version = self.mirror.current_version(force_refresh)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        # Miss: filter the mirror's rows, and cache the result unless the mirror changed meanwhile
+        version, records = self.mirror.snapshot()
+        templates = [record for record in records if template_matches(record, content_format, tags, category)]
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = templates
+                if len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return templates
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DraftSimilarityIndex:
+    """
+    Per-user near-duplicate index over the Generated Content table.
+
+    The table is loaded on a background thread the first time it is needed
+    (lookups report no match until then), drafts are added as they are saved,
+    and drafts saved by other processes are pulled in with a CREATED_TIME()
+    watermark once the TTL has passed.
+    """
+
+    def __init__(self, generated_content_table, generation_requests_table,
+                 max_distance=SIMILARITY_MAX_DISTANCE, ttl=SIMILARITY_INDEX_TTL):
+        self.generated_content_table = generated_content_table
+        self.generation_requests_table = generation_requests_table
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._users = {}
+        self._request_users = {}
+        self._request_lookup = RecordLookup(generation_requests_table, fields=['Accounts (Users)'])
+        self._watermark = None
+        self._last_sync = 0.0
+        self._loader = None
+
+    def _user_index(self, user_id):
+        index = self._users.get(user_id)
+        if index is None:
+            index = self._users[user_id] = SimHashIndex()
+        return index
+
+    def _add(self, user_id, fingerprint):
+        with self._lock:
+            index = self._user_index(user_id)
+            # Our own saves come back on the next sync; keep one copy
+            if fingerprint not in index:
+                index.add(fingerprint)
+
+    def _users_of_requests(self, request_ids):
+        # Map generation requests to their user, fetching the ones not seen yet
+        missing = [r for r in dict.fromkeys(request_ids) if r not in self._request_users]
+        for request_id, request in self._request_lookup.get_many(missing).items():
+            users = request['fields'].get('Accounts (Users)') or [None]
+            self._request_users[request_id] = users[0]
+
+    def _load(self, records):
+        self._users_of_requests(
+            r for record in records for r in record['fields'].get('Generation Request', [])
+        )
+        loaded = 0
+        for record in records:
+            content = record['fields'].get('First draft')
+            request_ids = record['fields'].get('Generation Request', [])
+            user_id = self._request_users.get(request_ids[0]) if request_ids else None
+            if content and user_id:
+                self._add(user_id, simhash(content))
+                loaded += 1
+        return loaded
+
+    def _sync(self):
+        started_at = datetime.now(timezone.utc)
+        fields = ['First draft', 'Generation Request']
+        if self._watermark is None:
+            records = self.generated_content_table.all(fields=fields)
+        else:
+            formula = f"IS_AFTER(CREATED_TIME(), '{self._watermark}')"
+            records = self.generated_content_table.all(formula=formula, fields=fields)
+        loaded = self._load(records)
+        self._watermark = format_airtable_time(started_at - WATERMARK_OVERLAP)
+        self._last_sync = time.time()
+        metrics_utils.set_gauge('similarity_index.drafts', sum(len(i) for i in self._users.values()))
+        logging.info(f"Loaded {loaded} generated drafts into the similarity index")
+
+    def _background_sync(self):
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._sync()
+        except Exception as e:
+            logging.error(f"Error syncing the similarity index: {e}")
+        finally:
+            self._sync_lock.release()
+
+    def refresh(self):
+        """
+        Start a background sync if the index was never loaded or the TTL has expired
+        """
+        if self._loader is not None and self._loader.is_alive():
+            return
+        if self._watermark is None or time.time() - self._last_sync >= self.ttl:
+            self._loader = threading.Thread(target=self._background_sync, name='similarity-index', daemon=True)
+            self._loader.start()
+
+    def find_duplicate(self, user_id, content):
+        """
+        Hamming distance to the closest earlier draft of the user if it is a
+        near-duplicate of content, otherwise None
+        """
+        self.refresh()
+        fingerprint = simhash(content)
+        with self._lock:
+            index = self._users.get(user_id)
+            distance = index.nearest(fingerprint, self.max_distance) if index else None
+        metrics_utils.increment('similarity_index.queries')
+        if distance is not None:
+            metrics_utils.increment('similarity_index.duplicates')
+        return distance
+
+    def add(self, user_id, content):
+        """
+        Record a saved draft of the user
+        """
+        if content:
+            self._add(user_id, simhash(content))
+
+
 class AirtableClient:
     def __init__(self):
         try:
@@ -29,13 +890,37 @@ class AirtableClient:
             if not self.api_token or not self.base_id:
                 raise ValueError("Airtable API token or Base ID is missing.")
 
-            # Initialize tables
-            self.generation_requests_table = Table(self.api_token, self.base_id, GENERATION_REQUESTS_TABLE_NAME)
-            self.generated_content_table = Table(self.api_token, self.base_id, GENERATED_CONTENT_TABLE_NAME)
-            self.users_table = Table(self.api_token, self.base_id, USERS_TABLE_NAME)
-            self.templates_table = Table(self.api_token, self.base_id, TEMPLATES_TABLE_NAME)
-            self.sources_table = Table(self.api_token, self.base_id, SOURCES_TABLE_NAME)
-            self.qa_pairs_table = Table(self.api_token, self.base_id, QA_PAIRS_TABLE_NAME)
+            # Initialize tables. They share one Api so every call goes through the base limiter.
+            # pyairtable is imported here, on first use, to keep importing this module cheap.
+            from airtable_api import RateLimitedApi
+            self.api = RateLimitedApi(
+                self.api_token, get_base_limiter(self.base_id), AIRTABLE_RATE_LIMIT_RETRIES,
+                endpoint_url=AIRTABLE_ENDPOINT_URL,
+            )
+            self.generation_requests_table = self.api.table(self.base_id, GENERATION_REQUESTS_TABLE_NAME)
+            self.generated_content_table = self.api.table(self.base_id, GENERATED_CONTENT_TABLE_NAME)
+            self.users_table = self.api.table(self.base_id, USERS_TABLE_NAME)
+            self.templates_table = self.api.table(self.base_id, TEMPLATES_TABLE_NAME)
+            self.sources_table = self.api.table(self.base_id, SOURCES_TABLE_NAME)
+            self.qa_pairs_table = self.api.table(self.base_id, QA_PAIRS_TABLE_NAME)
+
+            # Reference tables are read from a local mirror synced in the background
+            self.users_mirror = TableMirror(self.users_table, 'users', TABLE_MIRROR_PATH, 'Name')
+            self.templates_mirror = TableMirror(self.templates_table, 'templates', TABLE_MIRROR_PATH, 'Content Format')
+            self.sources_mirror = TableMirror(self.sources_table, 'sources', TABLE_MIRROR_PATH, 'Source_ID')
+            self.qa_pairs_mirror = TableMirror(self.qa_pairs_table, 'qa_pairs', TABLE_MIRROR_PATH, 'Source_ID')
+            self.qa_pair_index = QAPairIndex(self.qa_pairs_mirror)
+            self.template_cache = TemplateCache(self.templates_mirror)
+
+            # QA pair/template combinations are drawn without replacement per user
+            self.combination_sampler = CombinationSampler(COMBINATION_SAMPLER_PATH)
+            self.approval_bandit = ApprovalBandit(APPROVAL_STATS_PATH, BANDIT_EXPLORATION)
+
+            # Fingerprints of each user's earlier drafts, to drop near-duplicates before screening
+            self.draft_index = DraftSimilarityIndex(self.generated_content_table, self.generation_requests_table)
+
+            # Drafts are saved in batches on a background thread
+            self.generated_content_writer = WriteBehindQueue(self.generated_content_table)
         except Exception as e:
             logging.error(f"Error initializing AirtableClient: {e}")
             raise
@@ -69,80 +954,122 @@ class AirtableClient:
             logging.error(f"Error getting latest created time: {e}")
             return None
 
-    def get_user_by_id(self, user_id):
+    def get_user_by_id(self, user_id, force_refresh=False):
         
         """
         Fetch user record by ID
         """
         try:
-            user = self.users_table.get(user_id)
+            user = self.users_mirror.get(user_id, force_refresh)
             return user
         except Exception as e:
             logging.error(f"Error fetching user with ID {user_id}: {e}")
             return None
 
-    def get_templates(self, content_format, tags=None, category=None):
-        # Build formula for filtering templates
-        try:
-            conditions = []
-            if content_format:
-                conditions.append("{{Content Format}}='{}'".format(content_format))
-            if category:
-                conditions.append("{{AAAA Category}}='{}'".format(category))
-            if tags:
-                tag_conditions = ["{{Tag}}='{}'".format(tag) for tag in tags]
-                tag_formula = "OR(" + ",".join(tag_conditions) + ")"
-                conditions.append(tag_formula)
-            if conditions:
-                formula = "AND(" + ",".join(conditions) + ")"
-                templates = self.templates_table.all(formula=formula)
-            else:
-                templates = self.templates_table.all()
-            return templates
+    def get_users_by_ids(self, user_ids, force_refresh=False):
+        """
+        Fetch user records by ID in one batched lookup: {user_id: user}
+        """
+        try:
+            return self.users_mirror.get_many(list(dict.fromkeys(user_ids)), force_refresh)
+        except Exception as e:
+            logging.error(f"Error fetching users: {e}")
+            return {}
+
+    def get_templates(self, content_format, tags=None, category=None, force_refresh=False):
+        # Filter templates from the mirror, caching the result per filter combination
+        try:
+            return self.template_cache.get(content_format, tags, category, force_refresh)
         except Exception as e:
             logging.error(f"Error fetching templates: {e}")
             return []
 
-    def get_sources_by_ids(self, source_ids):
-        # Fetch sources by a list of IDs
-        sources = []
+    def get_sources_by_ids(self, source_ids, force_refresh=False):
+        # Fetch sources by a list of IDs, in the order given (missing IDs are left out)
         try:
-            for source_id in source_ids:
-                source = self.sources_table.get(source_id)
-                sources.append(source)
-            return sources
+            found = self.sources_mirror.get_many(list(dict.fromkeys(source_ids)), force_refresh)
+            return [found[source_id] for source_id in source_ids if source_id in found]
         except Exception as e:
             logging.error(f"Error fetching sources: {e}")
-            return sources
+            return []
 
-    def get_random_qa_pair(self, source_ids):
-        # Fetch QA pairs, optionally filtering by source IDs
+    def get_random_qa_pair(self, source_ids, force_refresh=False):
+        # Pick a random QA pair from the in-memory index, optionally filtering by source IDs
         try:
-            if source_ids:
-                # Build formula to filter by source IDs
-                source_conditions = ["{{Source_ID}}='{}'".format(source_id) for source_id in source_ids]
-                source_formula = "OR(" + ",".join(source_conditions) + ")"
-                qa_pairs = self.qa_pairs_table.all(formula=source_formula)
-            else:
-                qa_pairs = self.qa_pairs_table.all()
-            # Select a random QA pair
-            if qa_pairs:
-                import random
-                qa_pair = random.choice(qa_pairs)
-                return qa_pair
-            else:
-                return None
+            if force_refresh:
+                self.qa_pair_index.refresh(force=True)
+            return self.qa_pair_index.random_pair(source_ids)
         except Exception as e:
             logging.error(f"Error fetching random QA pair: {e}")
             return None
 
-    def save_generated_content(self, fields):
-        # Save generated content to Airtable
+    def pick_combination(self, user_id, source_ids, templates):
+        """
+        Pick a (QA pair, template) combination not used yet for this user and
+        sources, favouring the templates and sources with the best approval rate
+        """
+        try:
+            qa_pairs = self.qa_pair_index.pairs(source_ids)
+            by_source = {}
+            for record in qa_pairs:
+                by_source.setdefault(qa_pair_source(record), set()).add(record['id'])
+            preferred = None
+            if len(by_source) > 1:
+                preferred = by_source[self.approval_bandit.choose(user_id, 'source', list(by_source))]
+            return self.combination_sampler.pick(
+                user_id, source_ids, qa_pairs, templates,
+                choose_template=lambda template_ids: self.approval_bandit.choose(user_id, 'template', template_ids),
+                preferred=preferred,
+            )
+        except Exception as e:
+            logging.error(f"Error picking a QA pair and template: {e}")
+            return None, None
+
+    def get_approval_rate(self, user_id, default_rate):
+        """
+        The user's approval rate across templates (default_rate without history)
+        and the number of screened drafts it is based on
+        """
+        try:
+            return self.approval_bandit.approval_rate(user_id, prior=(default_rate * 2, (1 - default_rate) * 2))
+        except Exception as e:
+            logging.error(f"Error reading approval rate: {e}")
+            return default_rate, 0
+
+    def record_screening_outcome(self, user_id, template_id, source_id, approved):
+        # Feed a screening outcome back into the template and source selection
         try:
-            self.generated_content_table.create(fields)
+            self.approval_bandit.record(user_id, 'template', template_id, approved)
+            if source_id:
+                self.approval_bandit.record(user_id, 'source', source_id, approved)
+        except Exception as e:
+            logging.error(f"Error recording screening outcome: {e}")
+
+    def save_generated_content(self, fields, user_id=None):
+        # Queue generated content for a batched background write to Airtable
+        try:
+            self.generated_content_writer.put(fields)
+            if user_id:
+                self.draft_index.add(user_id, fields.get('First draft'))
         except Exception as e:
             logging.error(f"Error saving generated content: {e}")
 
+    def find_duplicate_draft(self, user_id, content):
+        # Distance to a near-identical earlier draft of the user, or None
+        try:
+            return self.draft_index.find_duplicate(user_id, content)
+        except Exception as e:
+            logging.error(f"Error querying the similarity index: {e}")
+            return None
+
+    def flush_generated_content(self, timeout=None):
+        # Wait for queued generated content to be written (or spilled)
+        try:
+            return self.generated_content_writer.flush(timeout)
+        except Exception as e:
+            logging.error(f"Error flushing generated content: {e}")
+            return False
+
     def get_sample_content(self, user):
         # Get sample content from user record
         try:
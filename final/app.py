@@ -1,20 +1,29 @@
 # app.py
 
 from flask import Flask, request, jsonify
-import time
-import random
+from datetime import datetime
 import os
-from pathlib import Path
 import logging
-from airtable_utils import AirtableClient
+import threading
+import socket
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import dotenv_values
+from airtable_utils import AirtableClient, qa_pair_source
+from leader_lease import LeaderLease
+from request_leases import RequestLeases
+from bulk_generation import run_bulk_generation, has_checkpoint, BULK_MAX_BATCH_SIZE
+from prescreen import PreScreen, prescreen_result
+import metrics_utils
 from ai_utils import (
     generate_content_with_claude,
     voice_and_brand_edit_with_claude,
+    generate_and_edit_with_claude,
     rewrite_content_to_fit_limit,
-    ai_screen_content,
+    ScreeningBatcher,
+    CostMeter,
     generate_content_prompt,
 )
-from apscheduler.schedulers.background import BackgroundScheduler
+from attempt_planner import AttemptPlanner
 import atexit
 
 # Initialize Flask app
@@ -23,15 +32,125 @@ app = Flask(__name__)
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize Airtable client
-airtable_client = AirtableClient()
+# Load environment variables from .env file
+secrets = dotenv_values(".env")
+
+# Number of generation attempts run in parallel for a single request (1 = sequential).
+# The planner launches as many as the request needs, up to this many at a time.
+GENERATION_CONCURRENCY = max(1, int(secrets.get("GENERATION_CONCURRENCY", 1)))
+
+# Attempt planning: launch enough attempts to reach the requested approvals with
+# PLANNER_TARGET_PROBABILITY given the user's approval history (DEFAULT_APPROVAL_RATE
+# for new users), and stop launching once GENERATION_BUDGET_PER_DRAFT (USD per
+# requested draft) is spent. ATTEMPT_COST_ESTIMATE (USD) is used until the first
+# attempt of a request has been measured.
+PLANNER_TARGET_PROBABILITY = float(secrets.get("PLANNER_TARGET_PROBABILITY", 0.9))
+DEFAULT_APPROVAL_RATE = float(secrets.get("DEFAULT_APPROVAL_RATE", 0.3))
+GENERATION_BUDGET_PER_DRAFT = float(secrets.get("GENERATION_BUDGET_PER_DRAFT", 0.5))
+ATTEMPT_COST_ESTIMATE = float(secrets.get("ATTEMPT_COST_ESTIMATE", 0.1))
+
+# Hard limits per request, whatever the budget: at most MAX_ATTEMPTS_PER_DRAFT
+# attempts per requested draft, and none after MAX_CONSECUTIVE_FAILURES attempts
+# in a row failed (e.g. an invalid API key). A failed attempt is charged at
+# least ATTEMPT_COST_ESTIMATE.
+MAX_ATTEMPTS_PER_DRAFT = max(1, int(secrets.get("MAX_ATTEMPTS_PER_DRAFT", 5)))
+MAX_CONSECUTIVE_FAILURES = max(1, int(secrets.get("MAX_CONSECUTIVE_FAILURES", 5)))
+
+# Number of generation requests processed in parallel
+REQUEST_WORKERS = max(1, int(secrets.get("REQUEST_WORKERS", 1)))
+
+# "two_pass" drafts then edits for brand voice (two Opus calls), "single_pass"
+# produces the brand-tuned draft in one call
+GENERATION_MODE = secrets.get("GENERATION_MODE", "two_pass")
+
+# Drafts of the same request reviewed per screening call (1 = one call per
+# draft), and how long a draft waits for its batch to fill up (in seconds)
+SCREENING_BATCH_SIZE = max(1, int(secrets.get("SCREENING_BATCH_SIZE", 1)))
+SCREENING_BATCH_WAIT = float(secrets.get("SCREENING_BATCH_WAIT", 2))
+
+# When the screener rejects a draft but suggests new copy, screen the suggestion
+# instead of starting over, up to this many times per draft (0 = never)
+MAX_SALVAGE_ROUNDS = max(0, int(secrets.get("MAX_SALVAGE_ROUNDS", 1)))
+
+# Requests asking for at least this many drafts run in bulk mode on message
+# batches (0 = never). Bulk mode is slower to start but much cheaper per draft.
+BULK_GENERATION_THRESHOLD = int(secrets.get("BULK_GENERATION_THRESHOLD", 0))
+
+# Cursor file, next to this module unless overridden (e.g. by the benchmarks)
+LAST_PROCESSED_TIME_FILE = secrets.get(
+    "LAST_PROCESSED_TIME_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'last_processed_time.txt')
+)
+
+# Leader election: every gunicorn worker or replica runs the scheduler, but only
+# the process holding the lease in LEADER_LEASE_PATH polls Airtable. Replicas on
+# different hosts need this file on a shared volume.
+# Every process renews or tries to take the lease every LEADER_RENEW_INTERVAL
+# seconds, so a dead leader is replaced within LEADER_LEASE_TTL +
+# LEADER_RENEW_INTERVAL seconds, and at once when it shuts down cleanly.
+LEADER_LEASE_PATH = secrets.get(
+    "LEADER_LEASE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'leader_lease.sqlite3')
+)
+LEADER_LEASE_TTL = float(secrets.get("LEADER_LEASE_TTL", 20))
+LEADER_RENEW_INTERVAL = float(secrets.get("LEADER_RENEW_INTERVAL", 5))
+
+# Sharding: the leader registers the requests it fetches in LEADER_LEASE_PATH and
+# every process claims the ones of the users that hash to its node (rendezvous
+# hashing over the live nodes), up to REQUEST_WORKERS at a time. A claim is a
+# lease of REQUEST_LEASE_TTL seconds renewed every LEADER_RENEW_INTERVAL
+# seconds; the users and requests of a node that stops renewing move to the
+# others. Processes with the same WORKER_NODE_ID (by default the host name, so
+# gunicorn workers and restarts keep their users) share one slot in the hash.
+WORKER_NODE_ID = secrets.get("WORKER_NODE_ID") or socket.gethostname()
+REQUEST_LEASE_TTL = float(secrets.get("REQUEST_LEASE_TTL", 60))
+
+# Airtable client, built on first use (see get_airtable_client)
+_airtable_client = None
+_airtable_client_lock = threading.Lock()
+
+# Polling scheduler, started by an entry point (see start_scheduler)
+scheduler = None
+_scheduler_lock = threading.Lock()
+leader_lease = None
+
+# Pool for generation requests and the shared store of their leases
+request_executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS)
+_request_leases = None
+_request_leases_lock = threading.Lock()
+
+def get_airtable_client():
+    """
+    The shared AirtableClient, built on the first call. A failed construction
+    (e.g. a missing token) is retried on the next call.
+    """
+    global _airtable_client
+    if _airtable_client is None:
+        with _airtable_client_lock:
+            if _airtable_client is None:
+                _airtable_client = AirtableClient()
+    return _airtable_client
+
+def get_request_leases():
+    """
+    The shared RequestLeases store, opened on the first call. Until a request
+    has been finished, the cursor starts from 'last_processed_time.txt'.
+    """
+    global _request_leases
+    if _request_leases is None:
+        with _request_leases_lock:
+            if _request_leases is None:
+                _request_leases = RequestLeases(
+                    LEADER_LEASE_PATH, WORKER_NODE_ID, REQUEST_LEASE_TTL,
+                    default_watermark=read_last_processed_time(), on_advance=write_last_processed_time,
+                )
+    return _request_leases
 
 def read_last_processed_time():
     """
     Read the last processed time from 'last_processed_time.txt' in the current directory
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'last_processed_time.txt')
+    file_path = LAST_PROCESSED_TIME_FILE
     try:
         if os.path.exists(file_path):
             with open(file_path, 'r') as file:
@@ -47,16 +166,170 @@ def write_last_processed_time(last_time):
     """
     Write the last processed time to 'last_processed_time.txt'
     """
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    file_path = os.path.join(current_dir, 'last_processed_time.txt')
+    file_path = LAST_PROCESSED_TIME_FILE
     try:
-        with open(file_path, 'w') as file:
+        # Write to a temp file first so a crash never leaves a truncated cursor
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w') as file:
             file.write(last_time)
+        os.replace(tmp_path, file_path)
     except Exception as e:
         logging.error(f"Error writing to last_processed_time.txt: {e}")
 
-def process_generation_request(request):
+def run_generation_attempt(request_id, user_id, brand_voice, prescreen, screener, source_ids, templates, stop_event):
+    """
+    Run one generate -> edit -> (rewrite) -> pre-screen -> screen -> (salvage) attempt.
+    Returns the Generated Content fields for the screened draft, or None if
+    the attempt failed or was cancelled before finishing.
+    """
+    airtable_client = get_airtable_client()
+    # Get a QA pair and template combination not used yet for this user
+    with metrics_utils.timed('stage.pick_qa_pair'):
+        qa_pair, template_record = airtable_client.pick_combination(user_id, source_ids, templates)
+    if not qa_pair:
+        logging.warning("No QA pairs available.")
+        return None
+    question = qa_pair['fields'].get('Question', '')
+    answer = qa_pair['fields'].get('Answer', '')
+    template = template_record['fields'].get('Template', '')
+
+    # Generate content
+    prompt = generate_content_prompt(brand_voice)
+    try:
+        if GENERATION_MODE == 'single_pass':
+            with metrics_utils.timed('stage.generate_and_edit'):
+                content = generate_and_edit_with_claude(prompt, question, answer, template, brand_voice)
+        else:
+            with metrics_utils.timed('stage.generate'):
+                content = generate_content_with_claude(prompt, question, answer, template)
+            if stop_event.is_set():
+                return None
+            with metrics_utils.timed('stage.edit'):
+                content = voice_and_brand_edit_with_claude(prompt, question, answer, template, content, brand_voice)
+    except Exception as e:
+        logging.error(f"Error during content generation with Claude: {e}")
+        return None
+
+    # Ensure content is within character limit
+    if len(content) > 280:
+        if stop_event.is_set():
+            return None
+        try:
+            with metrics_utils.timed('stage.rewrite'):
+                content = rewrite_content_to_fit_limit(content)
+        except Exception as e:
+            logging.error(f"Error during content rewriting to fit limit: {e}")
+            return None
+
+    logging.info(f"Generated Content: {content}")
+
+    # Local checks first: drafts breaking a known rule never reach the AI screener
+    reason = prescreen.check(content)
+    if reason:
+        airtable_client.record_screening_outcome(user_id, template_record['id'], qa_pair_source(qa_pair), False)
+        return {
+            'Generation Request': [request_id],
+            'First draft': content,
+            'AI screen': 'Rejected',
+            'Screening Result': prescreen_result(reason)
+        }
+
+    # AI screening
+    if stop_event.is_set():
+        return None
+    try:
+        with metrics_utils.timed('stage.screen'):
+            review = screener.screen(content)
+    except Exception as e:
+        logging.error(f"Error during AI screening: {e}")
+        return None
+
+    logging.info(f"Screening Result: {review['screening_result']}")
+    airtable_client.record_screening_outcome(user_id, template_record['id'], qa_pair_source(qa_pair), review['approved'])
+
+    # Salvage: screen the copy the screener suggested instead of regenerating
+    original = None
+    for _ in range(MAX_SALVAGE_ROUNDS):
+        suggested = review['suggested_copy']
+        if review['approved'] or not suggested or stop_event.is_set():
+            break
+        reason = prescreen.check(suggested, replaces=content)
+        if reason:
+            metrics_utils.increment('salvage.dropped')
+            break
+        metrics_utils.increment('salvage.attempted')
+        try:
+            with metrics_utils.timed('stage.salvage'):
+                salvaged = screener.screen(suggested)
+        except Exception as e:
+            logging.error(f"Error during AI screening of suggested copy: {e}")
+            break
+        logging.info(f"Salvage Screening Result: {salvaged['screening_result']}")
+        original = original or content
+        content, review = suggested, salvaged
+        if review['approved']:
+            metrics_utils.increment('salvage.approved')
+
+    screening_result = review['screening_result']
+    if original:
+        screening_result += f"\n\nSalvaged from the screener's suggested copy. Original draft:\n{original}"
+
+    return {
+        'Generation Request': [request_id],
+        'First draft': content,
+        'AI screen': 'Approved' if review['approved'] else 'Rejected',
+        'Screening Result': screening_result
+    }
+
+def run_metered_attempt(*args):
+    """
+    run_generation_attempt() that also returns the estimated cost of its LLM calls
+    """
+    with CostMeter() as meter:
+        fields = run_generation_attempt(*args)
+    return fields, meter.usd
+
+def make_planner(user_id, amount_to_generate, max_in_flight=GENERATION_CONCURRENCY):
+    # Attempt planner seeded with the user's approval history
+    approval_rate, history = get_airtable_client().get_approval_rate(user_id, DEFAULT_APPROVAL_RATE)
+    return AttemptPlanner(
+        approval_rate, history, PLANNER_TARGET_PROBABILITY,
+        budget=GENERATION_BUDGET_PER_DRAFT * amount_to_generate,
+        cost_estimate=ATTEMPT_COST_ESTIMATE,
+        max_in_flight=max_in_flight,
+        max_attempts=MAX_ATTEMPTS_PER_DRAFT * amount_to_generate,
+        max_failures=MAX_CONSECUTIVE_FAILURES,
+    )
+
+def save_attempt_result(request_id, user_id, fields):
+    """
+    Queue a screened draft for saving and report whether it was approved
+    """
+    airtable_client = get_airtable_client()
+    approved = fields['AI screen'] == 'Approved'
     try:
+        with metrics_utils.timed('stage.save'):
+            airtable_client.save_generated_content(fields, user_id)
+    except Exception as e:
+        logging.error(f"Error saving generated content to Airtable: {e}")
+        return False
+
+    if not approved:
+        logging.info("Content rejected by AI screener.")
+
+    logging.info(f"Processed Request ID: {request_id}, Status: {fields['AI screen']}")
+    logging.info("----------------------")
+    return approved
+
+def process_generation_request(request, lease_lost=None):
+    """
+    Generate and screen drafts until the request's amount is approved. Once
+    lease_lost is set (another process took the request over), no more
+    attempts are launched and no more drafts are saved.
+    """
+    lease_lost = lease_lost or threading.Event()
+    try:
+        airtable_client = get_airtable_client()
         # Extract request details
         request_id = request['id']
         fields = request['fields']
@@ -79,126 +352,218 @@ def process_generation_request(request):
         brand_voice = user['fields'].get('Brand Voice', '')
         sample_content = airtable_client.get_sample_content(user)
 
+        # Templates and QA pairs are the same for every attempt of a request
+        templates = airtable_client.get_templates(content_format, template_tags, category)
+        if not templates:
+            logging.warning("No templates available.")
+            return
+        if not airtable_client.get_random_qa_pair(source_ids):
+            logging.warning("No QA pairs available.")
+            return
+
+        # Large requests, and bulk runs interrupted by a restart, go through message batches
+        if (BULK_GENERATION_THRESHOLD and amount_to_generate >= BULK_GENERATION_THRESHOLD) or has_checkpoint(request_id):
+            run_bulk_generation(
+                airtable_client, request_id, user_id, amount_to_generate, brand_voice, sample_content,
+                source_ids, templates, GENERATION_MODE, MAX_SALVAGE_ROUNDS,
+                planner=make_planner(user_id, amount_to_generate, max_in_flight=BULK_MAX_BATCH_SIZE),
+                lease_lost=lease_lost,
+            )
+            return
+
+        # Drafts are pre-screened against each other and the user's earlier drafts
+        prescreen = PreScreen(find_duplicate=lambda content: airtable_client.find_duplicate_draft(user_id, content))
+
+        # Concurrent attempts share a batcher so their drafts can be screened together
+        screener = ScreeningBatcher(
+            sample_content, min(SCREENING_BATCH_SIZE, GENERATION_CONCURRENCY), SCREENING_BATCH_WAIT
+        )
+
         generated_count = 0
         attempts = 0
-        max_attempts = amount_to_generate * 5  # Limit to prevent infinite loops
-
-        while generated_count < amount_to_generate and attempts < max_attempts:
-            attempts += 1
-            logging.info(f"Generating content {generated_count + 1}/{amount_to_generate}")
-
-            # Get a random QA pair
-            qa_pair = airtable_client.get_random_qa_pair(source_ids)
-            if not qa_pair:
-                logging.warning("No QA pairs available.")
-                break
-            question = qa_pair['fields'].get('Question', '')
-            answer = qa_pair['fields'].get('Answer', '')
-
-            # Get a random template
-            templates = airtable_client.get_templates(content_format, template_tags, category)
-            if not templates:
-                logging.warning("No templates available.")
-                break
-            template = random.choice(templates)['fields'].get('Template', '')
-
-            # Generate content
-            prompt = generate_content_prompt(brand_voice)
-            try:
-                content = generate_content_with_claude(prompt, question, answer, template)
-                content = voice_and_brand_edit_with_claude(prompt, question, answer, template, content, brand_voice)
-            except Exception as e:
-                logging.error(f"Error during content generation with Claude: {e}")
-                continue
-
-            # Ensure content is within character limit
-            if len(content) > 280:
-                try:
-                    content = rewrite_content_to_fit_limit(content)
-                except Exception as e:
-                    logging.error(f"Error during content rewriting to fit limit: {e}")
-                    continue
-
-            logging.info(f"Generated Content: {content}")
-
-            # AI screening
-            try:
-                screening_result = ai_screen_content(content, sample_content)
-            except Exception as e:
-                logging.error(f"Error during AI screening: {e}")
-                continue
-
-            logging.info(f"Screening Result: {screening_result}")
-
-            # Parse screening result
-            approved = False
-            lines = screening_result.strip().splitlines()
-            if lines:
-                first_line = lines[0].strip().lower()
-                if 'yes' in first_line:
-                    approved = True
-                elif 'no' in first_line:
-                    approved = False
-            content_status = 'Approved' if approved else 'Rejected'
-
-            # Save generated content
-            try:
-                airtable_client.save_generated_content({
-                    'Generation Request': [request_id],
-                    'First draft': content,
-                    'AI screen': content_status,
-                    'Screening Result': screening_result
-                })
-            except Exception as e:
-                logging.error(f"Error saving generated content to Airtable: {e}")
-                continue
-
-            if approved:
-                generated_count += 1
-            else:
-                logging.info("Content rejected by AI screener.")
-
-            # Delay to respect API rate limits
-            time.sleep(1)
-
-            logging.info(f"Processed Request ID: {request_id}, Status: {content_status}")
-            logging.info("----------------------")
+        planner = make_planner(user_id, amount_to_generate)
+        stop_event = threading.Event()
+
+        # Launch the attempts the planner asks for, topping up as results come in
+        with ThreadPoolExecutor(max_workers=GENERATION_CONCURRENCY) as executor:
+            in_flight = set()
+            while generated_count < amount_to_generate:
+                if lease_lost.is_set():
+                    logging.warning(f"Stopping request ID: {request_id}: taken over by another process")
+                    break
+                launch = planner.to_launch(amount_to_generate - generated_count, len(in_flight))
+                if launch:
+                    logging.info(
+                        f"Launching {launch} attempts ({generated_count}/{amount_to_generate} approved, "
+                        f"{len(in_flight)} in flight, approval rate {planner.approval_rate:.2f})"
+                    )
+                for _ in range(launch):
+                    attempts += 1
+                    in_flight.add(executor.submit(
+                        run_metered_attempt, request_id, user_id, brand_voice, prescreen, screener,
+                        source_ids, templates, stop_event
+                    ))
+                if not in_flight:
+                    logging.warning(f"Stopping request ID: {request_id}: {planner.stop_reason}")
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        fields, cost = future.result()
+                    except Exception as e:
+                        logging.error(f"Error in generation attempt: {e}")
+                        planner.record(0.0)
+                        continue
+                    planner.record(cost, fields['AI screen'] == 'Approved' if fields else None)
+                    # Drafts finishing after the request is fulfilled (or taken over) are surplus
+                    if fields is None or generated_count >= amount_to_generate or lease_lost.is_set():
+                        continue
+                    if save_attempt_result(request_id, user_id, fields):
+                        generated_count += 1
+
+            # Cancel the surplus: queued attempts never start, running ones stop at the next stage
+            stop_event.set()
+            for future in in_flight:
+                future.cancel()
+
+        # Make sure every draft of this request has reached Airtable (or the spill file)
+        with metrics_utils.timed('stage.flush'):
+            airtable_client.flush_generated_content()
+        metrics_utils.increment('drafts.approved', generated_count)
+        metrics_utils.increment('attempts.started', attempts)
+        metrics_utils.increment('planner.waves', planner.waves)
+        metrics_utils.increment('requests.cost_usd', planner.spent)
+
+        logging.info(f"Request ID: {request_id} finished with {generated_count}/{amount_to_generate} approved after {attempts} attempts in {planner.waves} waves (${planner.spent:.2f})")
     except Exception as e:
         logging.error(f"Error processing generation request: {e}")
 
+def request_shard_key(request):
+    # Requests are sharded by user so a user's caches stay warm on one node
+    user_ids = request['fields'].get('Accounts (Users)', [])
+    return user_ids[0] if user_ids else request['id']
+
+def run_request(request):
+    """
+    Process a claimed generation request on the request pool, then keep
+    claiming and processing this node's requests until none are left
+    """
+    request_leases = get_request_leases()
+    while request:
+        try:
+            logging.info(f"Processing generation request ID: {request['id']}")
+            with metrics_utils.timed('request.total'):
+                process_generation_request(request, request_leases.lost_event(request['id']))
+        except Exception as e:
+            logging.error(f"Error processing generation request {request['id']}: {e}")
+        finally:
+            request_leases.finish(request['id'])
+        claimed = request_leases.claim(REQUEST_WORKERS)
+        request = claimed[0] if claimed else None
+        # The thread takes one; any others (lapsed leases) go to the pool
+        for other in claimed[1:]:
+            request_executor.submit(run_request, other)
+
+def claim_requests():
+    """
+    Claim this node's open requests up to the free request workers and
+    start processing them
+    """
+    try:
+        claimed = get_request_leases().claim(REQUEST_WORKERS)
+        if len(claimed) > 1:
+            # Load the users of the whole batch in one lookup before the workers ask for them
+            get_airtable_client().get_users_by_ids(
+                user_id for request in claimed for user_id in request['fields'].get('Accounts (Users)', [])[:1]
+            )
+        for request in claimed:
+            request_executor.submit(run_request, request)
+    except Exception as e:
+        logging.error(f"Error in claim_requests: {e}")
+
 def check_for_new_requests():
     try:
+        airtable_client = get_airtable_client()
+        request_leases = get_request_leases()
         logging.info("Checking for new generation requests...")
-        last_processed_time = read_last_processed_time()
+        last_processed_time = request_leases.watermark()
         print(last_processed_time)
         generation_requests = airtable_client.get_new_generation_requests(last_processed_time)
         if generation_requests:
-            # Sort requests by 'Created Time' to process them in order
-            generation_requests.sort(key=lambda x: x['createdTime'])
-            for request in generation_requests:
-                logging.info(f"Processing generation request ID: {request['id']}")
-                process_generation_request(request)
-                # Update the last processed time
-                last_processed_time = request['createdTime']
-                write_last_processed_time(last_processed_time)
+            # Make them claimable by every node; already registered ones are skipped
+            request_leases.register(generation_requests, request_shard_key)
         else:
             logging.info("No new generation requests found.")
     except Exception as e:
         logging.error(f"Error in check_for_new_requests: {e}")
+    claim_requests()
+
+def poll_if_leader():
+    """
+    Scheduler job: check for new requests if this process holds the lease,
+    otherwise claim the ones the leader registered
+    """
+    if leader_lease.is_leader:
+        check_for_new_requests()
+    else:
+        claim_requests()
 
-# Set up the scheduler to run check_for_new_requests() every 30 seconds
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=check_for_new_requests, trigger="interval", seconds=30)
-scheduler.start()
+def renew_leadership():
+    """
+    Scheduler job: keep or take the leader lease (polling right away on
+    taking it), renew the request leases of this process and claim new ones
+    """
+    was_leader = leader_lease.is_leader
+    if leader_lease.renew() and not was_leader:
+        scheduler.get_job('poll_requests').modify(next_run_time=datetime.now())
+    get_request_leases().heartbeat()
+    claim_requests()
 
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
+def start_scheduler():
+    """
+    Start running check_for_new_requests() every 30 seconds while this process
+    is the leader, and claiming requests on every process (once per process).
+    Called by the entry points below rather than on import.
+    """
+    global scheduler, leader_lease
+    with _scheduler_lock:
+        if scheduler is None:
+            from apscheduler.schedulers.background import BackgroundScheduler
+            leader_lease = LeaderLease(LEADER_LEASE_PATH, 'scheduler', LEADER_LEASE_TTL)
+            scheduler = BackgroundScheduler()
+            scheduler.add_job(func=poll_if_leader, trigger="interval", seconds=30, id='poll_requests')
+            scheduler.add_job(func=renew_leadership, trigger="interval", seconds=LEADER_RENEW_INTERVAL,
+                              next_run_time=datetime.now())
+            scheduler.start()
+            # Shut down the scheduler, then release the leases when exiting the app
+            atexit.register(lambda: get_request_leases().release())
+            atexit.register(lambda: leader_lease.release())
+            atexit.register(lambda: scheduler.shutdown())
+    return scheduler
+
+def create_app():
+    """
+    WSGI entry point, e.g. gunicorn "app:create_app()": starts the scheduler
+    and returns the Flask app
+    """
+    start_scheduler()
+    return app
+
+# Shut down the request pool when exiting the app
+atexit.register(lambda: request_executor.shutdown(wait=False, cancel_futures=True))
 
 # Define a simple route to ensure the app is running
 @app.route('/')
 def index():
     return "Ghostwriter Automation Web App is running."
 
+# Expose in-process metrics (rate limiter waits, call counts, ...)
+@app.route('/metrics')
+def metrics():
+    from http_pool import connection_stats
+    return jsonify(dict(metrics_utils.snapshot(), connections=connection_stats()))
+
 if __name__ == "__main__":
-    # Run the Flask app
+    # Start polling, then run the Flask app
+    start_scheduler()
     app.run(host='0.0.0.0', port=8080)
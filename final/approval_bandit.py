@@ -0,0 +1,122 @@
+# approval_bandit.py
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import metrics_utils
+
+
+class ApprovalBandit:
+    """
+    Thompson sampling over screening outcomes.
+
+    Keeps approved/rejected counts per (user, kind, arm), where kind is
+    'template' or 'source'. choose() draws an approval probability for every
+    candidate from its Beta(1 + approved, 1 + rejected) posterior and returns
+    the best draw. With probability `exploration` it picks uniformly instead,
+    so templates that start badly or were added later still get tried.
+    Counts are kept in memory and written through to SQLite.
+    """
+
+    def __init__(self, path, exploration=0.1):
+        self.path = path
+        self.exploration = exploration
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._loaded_users = set()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS arm_stats (
+                    user_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    arm_id TEXT NOT NULL,
+                    approved INTEGER NOT NULL,
+                    rejected INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, kind, arm_id)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _load(self, user_id):
+        if user_id in self._loaded_users:
+            return
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT kind, arm_id, approved, rejected FROM arm_stats WHERE user_id = ?", (user_id,)
+                ).fetchall()
+            for kind, arm_id, approved, rejected in rows:
+                self._stats[(user_id, kind, arm_id)] = [approved, rejected]
+        except sqlite3.Error as e:
+            logging.error(f"Error reading approval stats: {e}")
+        self._loaded_users.add(user_id)
+
+    def stats(self, user_id, kind, arm_id):
+        """
+        (approved, rejected) counts of one arm
+        """
+        with self._lock:
+            self._load(user_id)
+            approved, rejected = self._stats.get((user_id, kind, arm_id), (0, 0))
+        return approved, rejected
+
+    def approval_rate(self, user_id, prior=(1, 1)):
+        """
+        Posterior mean approval rate over all templates of a user, and the
+        number of outcomes it is based on
+        """
+        with self._lock:
+            self._load(user_id)
+            approved = rejected = 0
+            for (stats_user, kind, _), (a, r) in self._stats.items():
+                if stats_user == user_id and kind == 'template':
+                    approved += a
+                    rejected += r
+        return (approved + prior[0]) / (approved + rejected + prior[0] + prior[1]), approved + rejected
+
+    def choose(self, user_id, kind, arm_ids):
+        """
+        Pick one of arm_ids for the user
+        """
+        arm_ids = list(arm_ids)
+        if len(arm_ids) == 1:
+            return arm_ids[0]
+        if random.random() < self.exploration:
+            metrics_utils.increment(f'bandit.explore.{kind}')
+            return random.choice(arm_ids)
+        draws = {}
+        with self._lock:
+            self._load(user_id)
+            for arm_id in arm_ids:
+                approved, rejected = self._stats.get((user_id, kind, arm_id), (0, 0))
+                draws[arm_id] = random.betavariate(1 + approved, 1 + rejected)
+        metrics_utils.increment(f'bandit.exploit.{kind}')
+        return max(draws, key=draws.get)
+
+    def record(self, user_id, kind, arm_id, approved):
+        """
+        Add one screening outcome to an arm
+        """
+        with self._lock:
+            self._load(user_id)
+            counts = self._stats.setdefault((user_id, kind, arm_id), [0, 0])
+            counts[0 if approved else 1] += 1
+            row = (user_id, kind, arm_id, counts[0], counts[1], time.time())
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO arm_stats (user_id, kind, arm_id, approved, rejected, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        row,
+                    )
+            except sqlite3.Error as e:
+                logging.error(f"Error writing approval stats: {e}")
@@ -0,0 +1,133 @@
+# attempt_planner.py
+
+import math
+import threading
+
+
+def binomial_tail(n, p, k):
+    """
+    P(X >= k) for X ~ Binomial(n, p)
+    """
+    if k <= 0:
+        return 1.0
+    if k > n:
+        return 0.0
+    if p >= 1.0:
+        return 1.0
+    if p <= 0.0:
+        return 0.0
+    # Sum the lower tail in log space so large n does not overflow
+    log_p, log_q = math.log(p), math.log1p(-p)
+    lower = 0.0
+    for i in range(k):
+        log_term = math.lgamma(n + 1) - math.lgamma(i + 1) - math.lgamma(n - i + 1) + i * log_p + (n - i) * log_q
+        lower += math.exp(log_term)
+    return max(0.0, 1.0 - lower)
+
+def attempts_needed(needed, approval_rate, target_probability, limit=10000):
+    """
+    Smallest number of attempts giving at least `needed` approvals with
+    probability target_probability, if each is approved with approval_rate
+    """
+    if needed <= 0:
+        return 0
+    p = min(max(approval_rate, 0.01), 1.0)
+    # Start from the expected count and walk up
+    n = max(needed, int(needed / p) - 1)
+    while n < limit and binomial_tail(n, p, needed) < target_probability:
+        n += 1
+    return min(n, limit)
+
+
+class AttemptPlanner:
+    """
+    Decides how many generation attempts a request should have in flight.
+
+    The approval rate starts from the user's history (as Beta pseudo-counts)
+    and is updated with every outcome of the request. Enough attempts are
+    launched to reach the missing approvals with target_probability, up to
+    max_in_flight at a time, while the spend so far plus the expected cost of
+    the attempts in flight stays within budget.
+
+    A failed attempt is charged at least cost_estimate, so a broken API key
+    cannot keep the spend at zero. No more than max_attempts are launched in
+    total, and none after max_failures attempts in a row have failed.
+    """
+
+    def __init__(self, approval_rate, history, target_probability, budget, cost_estimate,
+                 max_in_flight, max_attempts, max_failures, min_weight=4, max_weight=20):
+        # The history counts as its number of outcomes, clamped so a new user is
+        # not over-trusted and a long history still lets this request move the rate
+        weight = min(max(history, min_weight), max_weight)
+        self.approved = approval_rate * weight
+        self.rejected = (1 - approval_rate) * weight
+        self.target_probability = target_probability
+        self.budget = budget
+        self.cost_estimate = cost_estimate
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.max_failures = max_failures
+        self.spent = 0.0
+        self.finished = 0
+        self.launched = 0
+        self.failures = 0
+        self.waves = 0
+        self._lock = threading.Lock()
+
+    @property
+    def approval_rate(self):
+        return self.approved / (self.approved + self.rejected)
+
+    def attempt_cost(self):
+        # Mean measured cost per attempt, the initial estimate until one has finished
+        if self.finished:
+            return max(self.spent / self.finished, self.cost_estimate / 10)
+        return self.cost_estimate
+
+    @property
+    def stop_reason(self):
+        """
+        Why no more attempts will be launched, or None while they may be
+        """
+        if self.failures >= self.max_failures:
+            return f"{self.failures} attempts failed in a row"
+        if self.launched >= self.max_attempts:
+            return f"all {self.max_attempts} attempts used"
+        if self.budget - self.spent < self.attempt_cost():
+            return f"budget of ${self.budget:.2f} spent"
+        return None
+
+    def to_launch(self, missing, in_flight):
+        """
+        Number of new attempts to start now
+        """
+        with self._lock:
+            if self.failures >= self.max_failures:
+                return 0
+            wanted = attempts_needed(missing, self.approval_rate, self.target_probability) - in_flight
+            slots = self.max_in_flight - in_flight
+            affordable = math.floor((self.budget - self.spent) / self.attempt_cost()) - in_flight
+            launch = max(0, min(wanted, slots, affordable, self.max_attempts - self.launched))
+            if launch:
+                self.waves += 1
+                self.launched += launch
+            return launch
+
+    def record(self, cost, approved=None):
+        """
+        Account for a finished attempt: its cost and, if it was screened, the
+        outcome. An attempt without an outcome failed.
+        """
+        with self._lock:
+            self.finished += 1
+            if approved is None:
+                # Charged at least the estimate, so failures use up the budget too
+                self.spent += max(cost, self.cost_estimate)
+                self.failures += 1
+                return
+            self.spent += cost
+            self.failures = 0
+            if approved:
+                self.approved += 1
+            else:
+                self.rejected += 1
@@ -0,0 +1,572 @@
+# fake_services.py
+#
+# Local stand-ins for the Airtable, Anthropic and OpenAI HTTP APIs, used by the
+# benchmarks. One threaded HTTP server answers all three:
+#
+#   /v0/<base>/<table>...   Airtable records API (list, get, create, update)
+#   /v1/messages            Anthropic Messages API
+#   /v1/messages/batches    Anthropic Message Batches API
+#   /v1/chat/completions    OpenAI Chat Completions API
+#
+# Latency, error rate and screener approval rate are configurable per service.
+
+import json
+import random
+import re
+import string
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+def now_iso():
+    dt = datetime.now(timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f"{dt.microsecond // 1000:03d}Z"
+
+
+def new_record_id():
+    return 'rec' + ''.join(random.choices(string.ascii_letters + string.digits, k=14))
+
+
+class FormulaError(Exception):
+    pass
+
+
+class Formula:
+    """
+    Evaluator for the subset of Airtable formulas the app sends:
+    AND, OR, NOT, IS_AFTER, CREATED_TIME(), LAST_MODIFIED_TIME(), RECORD_ID(),
+    {Field} references, string/number literals and = / != comparisons.
+    """
+
+    TOKEN = re.compile(r"\s*(?:(\{[^}]*\})|('(?:[^'\\]|\\.)*')|(\"(?:[^\"\\]|\\.)*\")|(\d+(?:\.\d+)?)|([A-Z_]+)|(!=|=|\(|\)|,))")
+
+    def __init__(self, text):
+        self.tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = self.TOKEN.match(text, position)
+            if not match:
+                raise FormulaError(f"Cannot parse formula at: {text[position:]}")
+            kind = match.lastindex
+            value = match.group(kind)
+            if kind in (2, 3):
+                value = value[1:-1].replace("\\'", "'").replace('\\"', '"')
+            self.tokens.append((kind, value))
+            position = match.end()
+        self.position = 0
+        self.tree = self._expression()
+        if self.position != len(self.tokens):
+            raise FormulaError(f"Unexpected trailing tokens in formula: {text}")
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _take(self, value=None):
+        token = self._peek()
+        if value is not None and token[1] != value:
+            raise FormulaError(f"Expected {value!r}, got {token[1]!r}")
+        self.position += 1
+        return token
+
+    def _expression(self):
+        left = self._primary()
+        if self._peek()[1] in ('=', '!='):
+            operator = self._take()[1]
+            return ('cmp', operator, left, self._primary())
+        return left
+
+    def _primary(self):
+        kind, value = self._take()
+        if kind == 1:
+            return ('field', value[1:-1])
+        if kind in (2, 3):
+            return ('literal', value)
+        if kind == 4:
+            return ('literal', float(value))
+        if kind == 5:
+            self._take('(')
+            args = []
+            if self._peek()[1] != ')':
+                args.append(self._expression())
+                while self._peek()[1] == ',':
+                    self._take(',')
+                    args.append(self._expression())
+            self._take(')')
+            return ('call', value, args)
+        raise FormulaError(f"Unexpected token {value!r}")
+
+    @staticmethod
+    def _text(value):
+        # Airtable compares lookups and multi-selects as comma-joined text
+        if isinstance(value, list):
+            return ', '.join(str(v) for v in value)
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    def evaluate(self, record, node=None):
+        node = self.tree if node is None else node
+        kind = node[0]
+        if kind == 'literal':
+            return node[1]
+        if kind == 'field':
+            return record['fields'].get(node[1])
+        if kind == 'cmp':
+            equal = self._text(self.evaluate(record, node[2])) == self._text(self.evaluate(record, node[3]))
+            return equal if node[1] == '=' else not equal
+        name, args = node[1], node[2]
+        values = [self.evaluate(record, arg) for arg in args]
+        if name == 'AND':
+            return all(values)
+        if name == 'OR':
+            return any(values)
+        if name == 'NOT':
+            return not values[0]
+        if name == 'IS_AFTER':
+            return self._text(values[0]) > self._text(values[1])
+        if name == 'IS_BEFORE':
+            return self._text(values[0]) < self._text(values[1])
+        if name == 'CREATED_TIME':
+            return record['createdTime']
+        if name == 'LAST_MODIFIED_TIME':
+            return record['_modified']
+        if name == 'RECORD_ID':
+            return record['id']
+        if name == 'ARRAYJOIN':
+            return self._text(values[0])
+        if name == 'BLANK':
+            return None
+        raise FormulaError(f"Unsupported formula function {name}")
+
+
+class FakeAirtable:
+    """
+    In-memory Airtable base
+    """
+
+    PAGE_SIZE = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def seed(self, table, fields_list, created_time=None):
+        """
+        Insert records directly (not counted as API calls). Returns the records.
+        """
+        records = []
+        with self.lock:
+            for fields in fields_list:
+                timestamp = created_time or now_iso()
+                record = {'id': new_record_id(), 'createdTime': timestamp, '_modified': timestamp, 'fields': dict(fields)}
+                self.tables.setdefault(table, {})[record['id']] = record
+                records.append(self.public(record))
+        return records
+
+    def records(self, table):
+        with self.lock:
+            return [self.public(r) for r in self.tables.get(table, {}).values()]
+
+    @staticmethod
+    def public(record):
+        return {'id': record['id'], 'createdTime': record['createdTime'], 'fields': dict(record['fields'])}
+
+    def list(self, table, params):
+        formula = params.get('filterByFormula')
+        fields = params.get('fields[]') or params.get('fields')
+        max_records = int(params['maxRecords']) if params.get('maxRecords') else None
+        page_size = int(params.get('pageSize') or self.PAGE_SIZE)
+        offset = int(params.get('offset') or 0)
+        with self.lock:
+            rows = list(self.tables.get(table, {}).values())
+            if formula:
+                compiled = Formula(formula)
+                rows = [r for r in rows if compiled.evaluate(r)]
+            rows.sort(key=lambda r: r['createdTime'])
+            if max_records is not None:
+                rows = rows[:max_records]
+            page = rows[offset:offset + page_size]
+            result = []
+            for record in page:
+                public = self.public(record)
+                if fields:
+                    public['fields'] = {k: v for k, v in public['fields'].items() if k in fields}
+                result.append(public)
+        body = {'records': result}
+        if offset + page_size < len(rows):
+            body['offset'] = str(offset + page_size)
+        return body
+
+    def get(self, table, record_id):
+        with self.lock:
+            record = self.tables.get(table, {}).get(record_id)
+            return self.public(record) if record else None
+
+    def create(self, table, fields_list):
+        return self.seed(table, fields_list)
+
+    def update(self, table, updates):
+        results = []
+        with self.lock:
+            for record_id, fields in updates:
+                record = self.tables.get(table, {}).get(record_id)
+                if record is None:
+                    return None
+                record['fields'].update(fields)
+                record['_modified'] = now_iso()
+                results.append(self.public(record))
+        return results
+
+    def delete(self, table, record_id):
+        with self.lock:
+            return self.tables.get(table, {}).pop(record_id, None) is not None
+
+
+class ServiceConfig:
+    """
+    Latency (seconds, uniform between min and max) and error rate for one fake API
+    """
+
+    def __init__(self, latency=(0.0, 0.0), error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def delay(self):
+        low, high = self.latency
+        if high > 0:
+            time.sleep(random.uniform(low, high))
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+
+class FakeServices:
+    """
+    Runs the fake APIs on a local port. Use as a context manager or call
+    start() / stop(). Call counts per endpoint are kept in self.calls.
+    """
+
+    def __init__(self, airtable=None, anthropic=None, openai=None, approval_rate=0.5,
+                 draft_length=(150, 350), seed=None, batch_latency=1.0):
+        self.airtable = FakeAirtable()
+        self.airtable_config = airtable or ServiceConfig()
+        self.anthropic_config = anthropic or ServiceConfig()
+        self.openai_config = openai or ServiceConfig()
+        self.approval_rate = approval_rate
+        self.draft_length = draft_length
+        self.random = random.Random(seed)
+        self.batch_latency = batch_latency
+        self.batches = {}
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name):
+        with self._calls_lock:
+            self.calls[name] += 1
+
+    def start(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_raw(self, status, payload, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+            def _dispatch(self, method):
+                parsed = urlparse(self.path)
+                parts = [unquote(p) for p in parsed.path.split('/') if p]
+                body = self._body() if method in ('POST', 'PATCH', 'PUT') else {}
+                try:
+                    if parts[:1] == ['v0']:
+                        services.handle_airtable(self, method, parts[1:], parsed, body)
+                    elif parts[:3] == ['v1', 'messages', 'batches']:
+                        services.handle_anthropic_batches(self, method, parts[3:], body)
+                    elif parts[:2] == ['v1', 'messages'] or parts[:3] == ['v1', 'beta', 'messages']:
+                        services.handle_anthropic(self, method, parts, body)
+                    elif parts[:3] == ['v1', 'chat', 'completions']:
+                        services.handle_openai(self, body)
+                    else:
+                        self._send(404, {'error': 'NOT_FOUND'})
+                except FormulaError as e:
+                    self._send(422, {'error': {'type': 'INVALID_FILTER_BY_FORMULA', 'message': str(e)}})
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_PATCH(self):
+                self._dispatch('PATCH')
+
+            def do_PUT(self):
+                self._dispatch('PUT')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Airtable
+
+    def handle_airtable(self, handler, method, parts, parsed, body):
+        config = self.airtable_config
+        config.delay()
+        table = parts[1] if len(parts) > 1 else None
+        record_id = parts[2] if len(parts) > 2 and parts[2] != 'listRecords' else None
+        self.count(f"airtable.{method}")
+        if config.should_fail():
+            handler._send(503, {'error': 'SERVICE_UNAVAILABLE'})
+            return
+
+        if method == 'GET' and record_id:
+            record = self.airtable.get(table, record_id)
+            if record is None:
+                handler._send(404, {'error': 'NOT_FOUND'})
+            else:
+                handler._send(200, record)
+        elif method == 'GET' or (method == 'POST' and parts[-1] == 'listRecords'):
+            if method == 'GET':
+                query = parse_qs(parsed.query)
+                params = {k: (v if k.endswith('[]') else v[0]) for k, v in query.items()}
+            else:
+                params = dict(body)
+            handler._send(200, self.airtable.list(table, params))
+        elif method == 'POST':
+            if 'records' in body:
+                records = self.airtable.create(table, [r['fields'] for r in body['records']])
+                handler._send(200, {'records': records})
+            else:
+                handler._send(200, self.airtable.create(table, [body.get('fields', {})])[0])
+        elif method in ('PATCH', 'PUT'):
+            if record_id:
+                updated = self.airtable.update(table, [(record_id, body.get('fields', {}))])
+                handler._send(200, updated[0]) if updated else handler._send(404, {'error': 'NOT_FOUND'})
+            else:
+                updated = self.airtable.update(table, [(r['id'], r.get('fields', {})) for r in body.get('records', [])])
+                handler._send(200, {'records': updated}) if updated is not None else handler._send(404, {'error': 'NOT_FOUND'})
+        elif method == 'DELETE' and record_id:
+            deleted = self.airtable.delete(table, record_id)
+            handler._send(200, {'id': record_id, 'deleted': deleted})
+        else:
+            handler._send(404, {'error': 'NOT_FOUND'})
+
+    # LLM text
+
+    def _draft(self):
+        # A vocabulary large enough that unrelated drafts do not look like near-duplicates
+        words = ('Growth comes from small habits done daily not big plans made once Most people quit too early '
+                 'Keep going sleep hiring trust teams learn build ship write read focus time money work rest '
+                 'clients product market users feedback simple hard slow fast cheap value risk fear start finish '
+                 'weekly boring lessons mistakes years months leaders managers founders customers story advice '
+                 'questions answers energy').split()
+        target = self.random.randint(*self.draft_length)
+        text = []
+        while len(' '.join(text)) < target:
+            text.append(self.random.choice(words))
+        return ' '.join(text) + '.'
+
+    @staticmethod
+    def _suggest(post):
+        # A tightened version of the post, as a copy editor would suggest
+        words = post.strip().rstrip('.').split()
+        return ' '.join(words[:max(3, len(words) - 4)]) + '. Keep going.'
+
+    def _screen(self, messages):
+        if self.random.random() < self.approval_rate:
+            return "Yes\n\n• Matches the voice and structure of the examples."
+        post = self._text_of(messages[-1]['content']).split('Post to review:', 1)[-1]
+        return ("No\n\n• Tone drifts from the examples.\n\n"
+                f"Suggested copy: {self._suggest(post)}")
+
+    def _screen_batch(self, messages):
+        # One JSON review per <post id="N"> in the request
+        posts = re.findall(r'<post id="(\d+)">\n(.*?)\n</post>', self._text_of(messages[-1]['content']), re.DOTALL)
+        reviews = []
+        for post, content in posts:
+            approved = self.random.random() < self.approval_rate
+            reviews.append({
+                'post': int(post),
+                'verdict': 'Yes' if approved else 'No',
+                'reasoning': ['Matches the examples.' if approved else 'Tone drifts from the examples.'],
+                'suggested_copy': None if approved else self._suggest(content),
+            })
+        return json.dumps(reviews)
+
+    @staticmethod
+    def _text_of(value):
+        if isinstance(value, list):
+            return ' '.join(block.get('text', '') if isinstance(block, dict) else str(block) for block in value)
+        return value or ''
+
+    def complete_anthropic(self, body):
+        """
+        Build a Messages API response body for a request body
+        """
+        system = self._text_of(body.get('system'))
+        if 'copy editor' in system and 'JSON array' in system:
+            text = self._screen_batch(body['messages'])
+        elif 'copy editor' in system:
+            text = self._screen(body['messages'])
+        else:
+            text = self._draft()
+        input_tokens = len(json.dumps(body)) // 4
+        return {
+            'id': 'msg_' + new_record_id(),
+            'type': 'message',
+            'role': 'assistant',
+            'model': body.get('model'),
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': len(text) // 4},
+        }
+
+    def handle_anthropic(self, handler, method, parts, body):
+        config = self.anthropic_config
+        config.delay()
+        self.count('anthropic.messages')
+        if config.should_fail():
+            handler._send(529, {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}})
+            return
+        headers = {
+            'anthropic-ratelimit-requests-limit': '4000',
+            'anthropic-ratelimit-requests-remaining': '3999',
+            'anthropic-ratelimit-tokens-limit': '400000',
+            'anthropic-ratelimit-tokens-remaining': '399000',
+        }
+        handler._send(200, self.complete_anthropic(body), headers)
+
+    def _batch_status(self, batch):
+        ended = time.time() - batch['_started'] >= self.batch_latency
+        public = {k: v for k, v in batch.items() if not k.startswith('_')}
+        if ended:
+            counts = Counter(result['result']['type'] for result in batch['_results'])
+            public.update(
+                processing_status='ended',
+                ended_at=now_iso(),
+                results_url=f"{self.url}/v1/messages/batches/{batch['id']}/results",
+                request_counts={'processing': 0, 'succeeded': counts['succeeded'], 'errored': counts['errored'],
+                                'canceled': 0, 'expired': 0},
+            )
+        return public
+
+    def handle_anthropic_batches(self, handler, method, parts, body):
+        if method == 'POST' and not parts:
+            self.count('anthropic.batches.create')
+            requests = body.get('requests', [])
+            results = []
+            for item in requests:
+                if self.anthropic_config.should_fail():
+                    result = {'type': 'errored', 'error': {'type': 'error', 'error': {'type': 'api_error', 'message': 'Internal error'}}}
+                else:
+                    result = {'type': 'succeeded', 'message': self.complete_anthropic(item['params'])}
+                results.append({'custom_id': item['custom_id'], 'result': result})
+            batch_id = 'msgbatch_' + new_record_id()
+            self.batches[batch_id] = {
+                'id': batch_id,
+                'type': 'message_batch',
+                'processing_status': 'in_progress',
+                'request_counts': {'processing': len(requests), 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0},
+                'created_at': now_iso(),
+                'expires_at': now_iso(),
+                'ended_at': None,
+                'archived_at': None,
+                'cancel_initiated_at': None,
+                'results_url': None,
+                '_started': time.time(),
+                '_results': results,
+            }
+            handler._send(200, self._batch_status(self.batches[batch_id]))
+            return
+        batch = self.batches.get(parts[0]) if parts else None
+        if batch is None:
+            handler._send(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}})
+        elif method == 'GET' and len(parts) == 1:
+            self.count('anthropic.batches.retrieve')
+            handler._send(200, self._batch_status(batch))
+        elif method == 'GET' and parts[1:] == ['results']:
+            self.count('anthropic.batches.results')
+            payload = ''.join(json.dumps(result) + '\n' for result in batch['_results']).encode()
+            handler._send_raw(200, payload, 'application/binary')
+        else:
+            handler._send(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': 'Not found'}})
+
+    def handle_openai(self, handler, body):
+        config = self.openai_config
+        config.delay()
+        self.count('openai.chat_completions')
+        if config.should_fail():
+            handler._send(500, {'error': {'message': 'Internal error', 'type': 'server_error'}})
+            return
+        content = self._text_of(body['messages'][-1]['content'])[:270]
+        prompt_tokens = len(json.dumps(body)) // 4
+        completion_tokens = len(content) // 4
+        headers = {
+            'x-ratelimit-limit-requests': '10000',
+            'x-ratelimit-remaining-requests': '9999',
+            'x-ratelimit-limit-tokens': '2000000',
+            'x-ratelimit-remaining-tokens': '1999000',
+        }
+        handler._send(200, {
+            'id': 'chatcmpl-' + new_record_id(),
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }, headers)
@@ -0,0 +1,140 @@
+# run_bulk_benchmark.py
+#
+# Offline check of the bulk (message batch) mode against the local fakes in
+# fake_services.py. Runs one large request end to end, then interrupts a
+# second one right after its first batch was submitted and checks that the
+# restarted run resumes polling that batch instead of submitting it again.
+#
+# Usage (from the final/ directory):
+#   python benchmarks/run_bulk_benchmark.py --amount 20 --batch-latency 0.5
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, APP_DIR)
+
+from fake_services import FakeServices, ServiceConfig
+from run_pipeline_benchmark import seed_base, make_request_fields, write_env, approved_drafts
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline check of the bulk generation mode")
+    parser.add_argument('--amount', type=int, default=20, help="Amount To Generate of the bulk requests")
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--templates', type=int, default=10)
+    parser.add_argument('--qa-pairs', type=int, default=500)
+    parser.add_argument('--batch-latency', type=float, default=0.5, help="seconds until a fake batch has ended")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of failing calls on every fake")
+    parser.add_argument('--approval-rate', type=float, default=0.5, help="share of drafts the fake screener approves")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="extra .env settings for the app")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    original_cwd = os.getcwd()
+    services = FakeServices(
+        airtable=ServiceConfig((0.0, 0.01), args.error_rate),
+        anthropic=ServiceConfig((0.0, 0.0), args.error_rate),
+        openai=ServiceConfig((0.0, 0.01), args.error_rate),
+        approval_rate=args.approval_rate,
+        seed=args.seed,
+        batch_latency=args.batch_latency,
+    )
+    failures = []
+    with services, tempfile.TemporaryDirectory() as workdir:
+        users = seed_base(services, args)
+        extra_env = {
+            'BULK_GENERATION_THRESHOLD': '1',
+            'BULK_POLL_INTERVAL': str(args.batch_latency / 4),
+            'BULK_CHECKPOINT_FILE': os.path.join(workdir, 'bulk_checkpoint.json'),
+        }
+        extra_env.update(item.split('=', 1) for item in args.env)
+        write_env(workdir, services, extra_env)
+
+        # The app reads its settings from .env in the working directory
+        os.chdir(workdir)
+        import app
+        import bulk_generation
+
+        # One large request end to end
+        request = {'id': 'recBulkRequest', 'createdTime': '2024-11-05T00:00:00.000Z',
+                   'fields': make_request_fields(users[0]['id'], args.amount)}
+        started = time.perf_counter()
+        app.process_generation_request(request)
+        elapsed = time.perf_counter() - started
+        approved = approved_drafts(services)
+        print("== bulk request ==")
+        print(f"  {'elapsed_s':<28} {elapsed:.2f}")
+        print(f"  {'approved_drafts':<28} {approved}/{args.amount}")
+        for name in ('anthropic.batches.create', 'anthropic.batches.retrieve', 'anthropic.batches.results',
+                     'anthropic.messages', 'openai.chat_completions'):
+            print(f"  {name:<28} {services.calls.get(name, 0)}")
+        if approved != args.amount:
+            failures.append(f"expected {args.amount} approved drafts, got {approved}")
+
+        # Interrupt a second request while its first batch is being polled
+        services.calls.clear()
+        resumed = {'id': 'recBulkResumed', 'createdTime': '2024-11-05T00:00:01.000Z',
+                   'fields': make_request_fields(users[0]['id'], args.amount)}
+        wait_for_batch = bulk_generation.wait_for_batch
+        earlier_batches = set(services.batches)
+
+        def crash(batch_id):
+            raise SimulatedCrash(batch_id)
+
+        bulk_generation.wait_for_batch = crash
+        try:
+            bulk_generation.run_bulk_generation(
+                app.get_airtable_client(), resumed['id'], users[0]['id'], args.amount, 'Plain.', 'Ship daily.',
+                resumed['fields']['Source_ID (from Source to Generate From?)'],
+                app.get_airtable_client().get_templates('Short Form Social Post', [], None),
+                app.GENERATION_MODE, app.MAX_SALVAGE_ROUNDS,
+                app.make_planner(users[0]['id'], args.amount, max_in_flight=bulk_generation.BULK_MAX_BATCH_SIZE),
+            )
+        except SimulatedCrash as e:
+            submitted = str(e)
+        finally:
+            bulk_generation.wait_for_batch = wait_for_batch
+        checkpoint = bulk_generation.load_checkpoint(resumed['id'])
+        if not checkpoint or checkpoint['batch_id'] != submitted:
+            failures.append("checkpoint does not hold the submitted batch")
+
+        # The restarted run picks the request up again through the normal entry point
+        creates_before = services.calls['anthropic.batches.create']
+        app.process_generation_request(resumed)
+        creates_after = services.calls['anthropic.batches.create']
+        print("== resume after crash ==")
+        print(f"  {'batches submitted before':<28} {creates_before}")
+        print(f"  {'batches submitted after':<28} {creates_after - creates_before}")
+        print(f"  {'checkpoint left':<28} {bulk_generation.has_checkpoint(resumed['id'])}")
+        if bulk_generation.has_checkpoint(resumed['id']):
+            failures.append("checkpoint was not removed after the request finished")
+        # Every round has one generate and one screen batch (salvage batches vary),
+        # so an extra generate batch means the interrupted one was submitted again
+        stages = [batch['_results'][0]['custom_id'].split('-')[0]
+                  for batch_id, batch in services.batches.items() if batch_id not in earlier_batches and batch['_results']]
+        if stages.count('generate') != stages.count('screen'):
+            failures.append("the interrupted batch was submitted again")
+
+        # Let the write-behind queue finish before the working directory goes away
+        app.get_airtable_client().generated_content_writer.close()
+        os.chdir(original_cwd)
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
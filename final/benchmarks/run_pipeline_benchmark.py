@@ -0,0 +1,228 @@
+# run_pipeline_benchmark.py
+#
+# Offline benchmark of the generation pipeline. Runs process_generation_request
+# and check_for_new_requests from app.py against the local fakes in
+# fake_services.py and reports per-stage timings, throughput, Airtable calls per
+# approved draft and peak memory.
+#
+# Usage (from the final/ directory):
+#   python benchmarks/run_pipeline_benchmark.py --requests 5 --amount 4 --llm-latency 0.2
+#
+# Any KEY=VALUE given with --env is written to the app's .env (e.g.
+# --env GENERATION_CONCURRENCY=4 --env REQUEST_WORKERS=2).
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, APP_DIR)
+
+from fake_services import FakeServices, ServiceConfig
+
+CONTENT_FORMAT = 'Short Form Social Post'
+SOURCE_ID = 'SRC-1'
+
+
+def seed_base(services, args):
+    """
+    Fill the fake base with users, templates, QA pairs and generation requests
+    """
+    airtable = services.airtable
+    users = airtable.seed('Accounts (Users)', [
+        {'Name': f'User {i}', 'Brand Voice': 'Plain, direct, practical.', 'Sample Content': 'Small habits win.\n\nShip daily.'}
+        for i in range(args.users)
+    ])
+    airtable.seed('Sources', [{'Source_ID': SOURCE_ID, 'Name': 'Interview'}])
+    airtable.seed('Templates', [
+        {'Template': f'Template {i}: [Hook]\n\n[Lesson]', 'Content Format': CONTENT_FORMAT}
+        for i in range(args.templates)
+    ])
+    airtable.seed('QA Pairs', [
+        {'Question': f'Question {i}?', 'Answer': f'Answer {i}.', 'Source_ID': SOURCE_ID}
+        for i in range(args.qa_pairs)
+    ])
+    return users
+
+
+def make_request_fields(user_id, amount):
+    return {
+        'Accounts (Users)': [user_id],
+        'Type': CONTENT_FORMAT,
+        'Amount To Generate': amount,
+        'Source_ID (from Source to Generate From?)': [SOURCE_ID],
+    }
+
+
+def write_env(workdir, services, extra):
+    values = {
+        'AIRTABLE_PERSONAL_TOKEN': 'fake-token',
+        'AIRTABLE_BASE_ID': 'appBenchmark',
+        'AIRTABLE_ENDPOINT_URL': services.url,
+        'ANTHROPIC_API': 'fake-key',
+        'ANTHROPIC_BASE_URL': services.url,
+        'OPENAI_API': 'fake-key',
+        'OPENAI_BASE_URL': services.url + '/v1',
+        'LAST_PROCESSED_TIME_FILE': os.path.join(workdir, 'last_processed_time.txt'),
+        'UNSAVED_DRAFTS_FILE': os.path.join(workdir, 'unsaved_drafts.jsonl'),
+        'REJECTED_DRAFTS_FILE': os.path.join(workdir, 'rejected_drafts.jsonl'),
+        'COMBINATION_SAMPLER_PATH': os.path.join(workdir, 'used_combinations.sqlite3'),
+        'APPROVAL_STATS_PATH': os.path.join(workdir, 'approval_stats.sqlite3'),
+        'TABLE_MIRROR_PATH': os.path.join(workdir, 'table_mirror.sqlite3'),
+        'LEADER_LEASE_PATH': os.path.join(workdir, 'leader_lease.sqlite3'),
+    }
+    values.update(extra)
+    with open(os.path.join(workdir, '.env'), 'w') as file:
+        for key, value in values.items():
+            file.write(f"{key}={value}\n")
+
+
+def approved_drafts(services):
+    return sum(1 for r in services.airtable.records('Python Automation Generated Content')
+               if r['fields'].get('AI screen') == 'Approved')
+
+
+def run_scenario(name, services, metrics_utils, func, generation_requests):
+    """
+    Run func() and collect its metrics
+    """
+    metrics_utils.reset()
+    services.calls.clear()
+    approved_before = approved_drafts(services)
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    snapshot = metrics_utils.snapshot()
+    approved = approved_drafts(services) - approved_before
+    airtable_calls = sum(v for k, v in services.calls.items() if k.startswith('airtable.'))
+    llm_calls = sum(v for k, v in services.calls.items() if not k.startswith('airtable.'))
+    return {
+        'scenario': name,
+        'elapsed_s': round(elapsed, 3),
+        'generation_requests': generation_requests,
+        'generation_requests_per_min': round(generation_requests / elapsed * 60, 2),
+        'llm_calls': llm_calls,
+        'llm_calls_per_min': round(llm_calls / elapsed * 60, 2),
+        'approved_drafts': approved,
+        'airtable_calls': airtable_calls,
+        'airtable_calls_per_approved_draft': round(airtable_calls / approved, 2) if approved else None,
+        'peak_memory_kb': round(peak / 1024, 1),
+        'calls': dict(services.calls),
+        'counters': snapshot['counters'],
+        'timings': {k: {'count': v['count'], 'mean_s': round(v['mean'], 4), 'max_s': round(v['max'], 4)}
+                   for k, v in sorted(snapshot['timings'].items())},
+    }
+
+
+def print_report(result):
+    print(f"\n== {result['scenario']} ==")
+    for key in ('elapsed_s', 'generation_requests', 'generation_requests_per_min', 'llm_calls',
+                'llm_calls_per_min', 'approved_drafts', 'airtable_calls',
+                'airtable_calls_per_approved_draft', 'peak_memory_kb'):
+        print(f"  {key:<36} {result[key]}")
+    print(f"  {'timing':<36} {'count':>6} {'mean (s)':>10} {'max (s)':>10}")
+    for name, timing in result['timings'].items():
+        print(f"  {name:<36} {timing['count']:>6} {timing['mean_s']:>10.4f} {timing['max_s']:>10.4f}")
+    checked = result['counters'].get('prescreen.checked', 0)
+    if checked:
+        rejected = result['counters'].get('prescreen.rejected', 0)
+        print(f"  {'prescreen_rejected':<36} {rejected}/{checked} ({rejected / checked:.0%})")
+    for service in ('airtable', 'anthropic', 'openai'):
+        requests = result['counters'].get(f'http.requests.{service}', 0)
+        if requests:
+            opened = result['counters'].get(f'http.connections_opened.{service}', 0)
+            print(f"  {'connections_' + service:<36} {opened} opened for {requests} requests")
+    salvaged = result['counters'].get('salvage.attempted', 0)
+    if salvaged:
+        approved = result['counters'].get('salvage.approved', 0)
+        print(f"  {'salvage_approved':<36} {approved}/{salvaged} ({approved / salvaged:.0%})")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the generation pipeline")
+    parser.add_argument('--requests', type=int, default=3, help="generation requests for the polling scenario")
+    parser.add_argument('--amount', type=int, default=3, help="Amount To Generate per request")
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--templates', type=int, default=10)
+    parser.add_argument('--qa-pairs', type=int, default=500)
+    parser.add_argument('--airtable-latency', type=float, default=0.02, help="max seconds per Airtable call")
+    parser.add_argument('--llm-latency', type=float, default=0.1, help="max seconds per LLM call")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of failing calls on every fake")
+    parser.add_argument('--approval-rate', type=float, default=0.5, help="share of drafts the fake screener approves")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="extra .env settings for the app")
+    parser.add_argument('--json', dest='json_path', help="also write the results to this JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    original_cwd = os.getcwd()
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    services = FakeServices(
+        airtable=ServiceConfig((args.airtable_latency / 2, args.airtable_latency), args.error_rate),
+        anthropic=ServiceConfig((args.llm_latency / 2, args.llm_latency), args.error_rate),
+        openai=ServiceConfig((args.llm_latency / 4, args.llm_latency / 2), args.error_rate),
+        approval_rate=args.approval_rate,
+        seed=args.seed,
+    )
+    with services, tempfile.TemporaryDirectory() as workdir:
+        users = seed_base(services, args)
+        write_env(workdir, services, extra_env)
+
+        # The app reads its settings from .env in the working directory
+        os.chdir(workdir)
+        import app
+        import ai_utils
+        import metrics_utils
+
+        # Clients are built on first use; build them here so the scenarios measure
+        # the pipeline rather than the SDK imports (see startup_time.py for those)
+        app.get_airtable_client()
+        ai_utils.get_anthropic_client()
+        ai_utils.get_openai_client()
+
+        results = []
+
+        # One request processed directly
+        single = {'id': 'recBenchmarkSingle', 'createdTime': '2024-11-05T00:00:00.000Z',
+                  'fields': make_request_fields(users[0]['id'], args.amount)}
+        results.append(run_scenario(
+            'process_generation_request', services, metrics_utils,
+            lambda: app.process_generation_request(single), 1,
+        ))
+
+        # Several requests picked up by one poll and drained by the request pool
+        services.airtable.seed('Generation Form Request', [
+            make_request_fields(users[i % len(users)]['id'], args.amount) for i in range(args.requests)
+        ])
+
+        def poll_and_drain():
+            app.check_for_new_requests()
+            app.request_executor.shutdown(wait=True)
+
+        results.append(run_scenario('check_for_new_requests', services, metrics_utils, poll_and_drain, args.requests))
+
+        # Let the write-behind queue finish before the working directory goes away
+        app.get_airtable_client().generated_content_writer.close()
+        os.chdir(original_cwd)
+
+    for result in results:
+        print_report(result)
+    if json_path:
+        with open(json_path, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
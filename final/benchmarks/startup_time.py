@@ -0,0 +1,103 @@
+# startup_time.py
+#
+# Cold-start check of the web app. Imports app.py in fresh interpreters and
+# fails if the median import time is over the budget, if importing loads one
+# of the heavy SDKs (they must stay lazy) or starts a thread. Also reports the
+# time to serve the first request to /.
+#
+# Usage (from the final/ directory):
+#   python benchmarks/startup_time.py --runs 5 --budget 0.5
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Modules that may only be imported once a client is first used
+LAZY_MODULES = ('anthropic', 'openai', 'pyairtable', 'httpx', 'requests', 'apscheduler')
+
+# Run in a fresh interpreter from the working directory holding the .env file
+PROBE = """
+import json, sys, threading, time
+sys.path.insert(0, {app_dir!r})
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({{
+    'import_s': imported - started,
+    'first_request_s': served - imported,
+    'status': response.status_code,
+    'loaded': [name for name in {lazy!r} if name in sys.modules],
+    'threads': [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()],
+}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cold-start import time check of the web app")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters to measure")
+    parser.add_argument('--budget', type=float, default=0.5, help="maximum median import time in seconds")
+    return parser.parse_args()
+
+
+def probe(workdir):
+    code = PROBE.format(app_dir=APP_DIR, lazy=LAZY_MODULES)
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=workdir, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        # Settings that keep every file the app writes inside the working directory
+        with open(os.path.join(workdir, '.env'), 'w') as file:
+            file.write("AIRTABLE_PERSONAL_TOKEN=fake-token\nAIRTABLE_BASE_ID=appFake\n")
+            file.write("ANTHROPIC_API=fake-key\nOPENAI_API=fake-key\n")
+            for key, name in (('LAST_PROCESSED_TIME_FILE', 'last_processed_time.txt'),
+                              ('UNSAVED_DRAFTS_FILE', 'unsaved_drafts.jsonl'),
+                              ('REJECTED_DRAFTS_FILE', 'rejected_drafts.jsonl'),
+                              ('COMBINATION_SAMPLER_PATH', 'used_combinations.sqlite3'),
+                              ('APPROVAL_STATS_PATH', 'approval_stats.sqlite3'),
+                              ('TABLE_MIRROR_PATH', 'table_mirror.sqlite3'),
+                              ('LEADER_LEASE_PATH', 'leader_lease.sqlite3'),
+                              ('BULK_CHECKPOINT_FILE', 'bulk_checkpoint.json')):
+                file.write(f"{key}={os.path.join(workdir, name)}\n")
+        runs = [probe(workdir) for _ in range(args.runs)]
+
+    import_s = statistics.median(run['import_s'] for run in runs)
+    first_request_s = statistics.median(run['first_request_s'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    threads = sorted({name for run in runs for name in run['threads']})
+    print("== startup ==")
+    print(f"  {'import_s (median)':<28} {import_s:.3f} (budget {args.budget:.3f})")
+    print(f"  {'import_s (max)':<28} {max(run['import_s'] for run in runs):.3f}")
+    print(f"  {'first_request_s (median)':<28} {first_request_s:.3f}")
+    print(f"  {'lazy modules loaded':<28} {', '.join(loaded) or 'none'}")
+    print(f"  {'threads started':<28} {', '.join(threads) or 'none'}")
+
+    if import_s > args.budget:
+        failures.append(f"median import time {import_s:.3f}s is over the {args.budget:.3f}s budget")
+    if loaded:
+        failures.append(f"importing app loads {', '.join(loaded)}")
+    if threads:
+        failures.append(f"importing app starts threads: {', '.join(threads)}")
+    if any(run['status'] != 200 for run in runs):
+        failures.append("GET / did not return 200")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
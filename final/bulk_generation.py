@@ -0,0 +1,319 @@
+# bulk_generation.py
+#
+# Offline bulk mode for large generation requests. Instead of one interactive
+# call per stage and draft, every stage of a round (generate, edit, screen,
+# salvage) is sent as a single Anthropic message batch and polled until it has
+# ended.
+# Batch IDs and the drafts in flight are checkpointed to a local JSON file so a
+# restarted process resumes polling the submitted batch instead of paying for
+# it again.
+
+import json
+import logging
+import os
+import threading
+import time
+from dotenv import dotenv_values
+import metrics_utils
+from airtable_utils import qa_pair_source
+from prescreen import PreScreen, prescreen_result
+from ai_utils import (
+    get_anthropic_client,
+    generate_content_params,
+    voice_and_brand_edit_params,
+    generate_and_edit_params,
+    screen_content_params,
+    rewrite_content_to_fit_limit,
+    parse_screening_result,
+    log_claude_usage,
+    CostMeter,
+    generate_content_prompt,
+)
+
+# Load environment variables from .env file
+secrets = dotenv_values(".env")
+
+# Seconds between two status checks of a submitted batch
+BULK_POLL_INTERVAL = float(secrets.get("BULK_POLL_INTERVAL", 60))
+
+# Rounds before giving up, and drafts per round (the Message Batches API
+# accepts up to 10,000 requests per batch)
+BULK_MAX_ROUNDS = int(secrets.get("BULK_MAX_ROUNDS", 5))
+BULK_MAX_BATCH_SIZE = 10000
+
+# Checkpoint file, next to this module unless overridden (e.g. by the benchmarks)
+BULK_CHECKPOINT_FILE = secrets.get(
+    "BULK_CHECKPOINT_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bulk_checkpoint.json')
+)
+
+# The batches endpoint takes the beta flags as a parameter rather than a header
+BATCH_BETAS = ["prompt-caching-2024-07-31"]
+
+_checkpoint_lock = threading.Lock()
+
+def _read_checkpoints():
+    try:
+        if os.path.exists(BULK_CHECKPOINT_FILE):
+            with open(BULK_CHECKPOINT_FILE, 'r') as file:
+                return json.load(file)
+    except Exception as e:
+        logging.error(f"Error reading {BULK_CHECKPOINT_FILE}: {e}")
+    return {}
+
+def _write_checkpoints(checkpoints):
+    # Write to a temp file first so a crash never leaves a truncated checkpoint
+    tmp_path = BULK_CHECKPOINT_FILE + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(checkpoints, file)
+    os.replace(tmp_path, BULK_CHECKPOINT_FILE)
+
+def load_checkpoint(request_id):
+    with _checkpoint_lock:
+        return _read_checkpoints().get(request_id)
+
+def has_checkpoint(request_id):
+    return load_checkpoint(request_id) is not None
+
+def save_checkpoint(request_id, state):
+    with _checkpoint_lock:
+        checkpoints = _read_checkpoints()
+        if state is None:
+            checkpoints.pop(request_id, None)
+        else:
+            checkpoints[request_id] = state
+        _write_checkpoints(checkpoints)
+
+def batch_request(custom_id, params):
+    # Batched requests cannot carry headers; the beta flags go on the batch itself
+    return {"custom_id": custom_id, "params": {k: v for k, v in params.items() if k != 'extra_headers'}}
+
+def wait_for_batch(batch_id):
+    """
+    Poll a message batch until it has ended and return its texts by custom_id.
+    Errored, cancelled and expired requests are left out.
+    """
+    while True:
+        batch = get_anthropic_client().beta.messages.batches.retrieve(batch_id, betas=BATCH_BETAS)
+        if batch.processing_status == 'ended':
+            break
+        logging.info(f"Batch {batch_id} is {batch.processing_status}: {batch.request_counts.processing} requests pending")
+        time.sleep(BULK_POLL_INTERVAL)
+
+    texts = {}
+    for item in get_anthropic_client().beta.messages.batches.results(batch_id, betas=BATCH_BETAS):
+        if item.result.type != 'succeeded':
+            logging.warning(f"Batch {batch_id} request {item.custom_id} {item.result.type}")
+            metrics_utils.increment(f"bulk.{item.result.type}")
+            continue
+        message = item.result.message
+        log_claude_usage(message.model, message.usage, price_factor=0.5)
+        texts[item.custom_id] = message.content[0].text
+    return texts
+
+def run_batch_stage(request_id, state, build_params, indices=None):
+    """
+    Submit one batch for every draft in the current stage, or the drafts at
+    indices, unless a batch is already checkpointed. Returns its results by
+    draft index.
+    """
+    stage = state['stage']
+    if indices is None:
+        indices = range(len(state['drafts']))
+    if not indices:
+        return {}
+    if not state.get('batch_id'):
+        requests = [
+            batch_request(f"{stage}-{index}", build_params(state['drafts'][index]))
+            for index in indices
+        ]
+        batch = get_anthropic_client().beta.messages.batches.create(requests=requests, betas=BATCH_BETAS)
+        state['batch_id'] = batch.id
+        # Checkpoint straight away: from here on a restart must not resubmit
+        save_checkpoint(request_id, state)
+        metrics_utils.increment('bulk.batches')
+        metrics_utils.increment('bulk.batch_requests', len(requests))
+        logging.info(f"Submitted {stage} batch {batch.id} with {len(requests)} requests for request ID: {request_id}")
+    else:
+        logging.info(f"Resuming {stage} batch {state['batch_id']} for request ID: {request_id}")
+
+    with metrics_utils.timed(f'stage.bulk_{stage}'):
+        texts = wait_for_batch(state['batch_id'])
+    state['batch_id'] = None
+    return {int(custom_id.split('-')[1]): text for custom_id, text in texts.items()}
+
+def pick_drafts(airtable_client, user_id, count, source_ids, templates):
+    # Inputs for count drafts: a QA pair and template combination not used yet each
+    drafts = []
+    for _ in range(count):
+        qa_pair, template = airtable_client.pick_combination(user_id, source_ids, templates)
+        if not qa_pair:
+            break
+        drafts.append({
+            'template_id': template['id'],
+            'source_id': qa_pair_source(qa_pair),
+            'question': qa_pair['fields'].get('Question', ''),
+            'answer': qa_pair['fields'].get('Answer', ''),
+            'template': template['fields'].get('Template', ''),
+        })
+    return drafts
+
+def run_bulk_generation(airtable_client, request_id, user_id, amount_to_generate, brand_voice, sample_content,
+                        source_ids, templates, generation_mode, salvage_rounds, planner, lease_lost=None):
+    """
+    Produce amount_to_generate approved drafts for a request with message
+    batches, resuming from the checkpoint if one exists. Each round is sized
+    and budgeted by the AttemptPlanner, and rejected drafts get up to
+    salvage_rounds screenings of the screener's suggested copy. Stops without
+    saving, and leaves the checkpoint alone, once lease_lost is set (another
+    process took the request over). Returns the number of approved drafts saved.
+    """
+    lease_lost = lease_lost or threading.Event()
+    state = load_checkpoint(request_id)
+    if state is None:
+        state = {'round': 0, 'approved': 0, 'stage': None, 'batch_id': None, 'drafts': []}
+    prompt = generate_content_prompt(brand_voice)
+    prescreen = PreScreen(find_duplicate=lambda content: airtable_client.find_duplicate_draft(user_id, content))
+
+    while state['approved'] < amount_to_generate and (state['stage'] or state['round'] < BULK_MAX_ROUNDS):
+        if lease_lost.is_set():
+            logging.warning(f"Stopping request ID: {request_id}: taken over by another process")
+            return state['approved']
+        # Cost of the LLM calls of this round, shared out over its drafts for the planner
+        with CostMeter() as round_cost:
+            # Start a round sized to the approvals still missing
+            if state['stage'] is None:
+                count = planner.to_launch(amount_to_generate - state['approved'], 0)
+                if not count:
+                    logging.warning(f"Stopping request ID: {request_id}: {planner.stop_reason}")
+                    break
+                state['drafts'] = pick_drafts(airtable_client, user_id, count, source_ids, templates)
+                if not state['drafts']:
+                    logging.warning("No QA pairs available.")
+                    break
+                state['round'] += 1
+                state['stage'] = 'generate'
+                logging.info(f"Bulk round {state['round']} for request ID: {request_id}: {len(state['drafts'])} drafts")
+
+            # Generate content
+            if state['stage'] == 'generate':
+                if generation_mode == 'single_pass':
+                    build = lambda d: generate_and_edit_params(prompt, d['question'], d['answer'], d['template'], brand_voice)
+                else:
+                    build = lambda d: generate_content_params(prompt, d['question'], d['answer'], d['template'])
+                results = run_batch_stage(request_id, state, build)
+                state['drafts'] = [dict(d, content=results[i]) for i, d in enumerate(state['drafts']) if i in results]
+                state['stage'] = 'rewrite' if generation_mode == 'single_pass' else 'edit'
+                save_checkpoint(request_id, state)
+
+            # Edit for voice and brand
+            if state['stage'] == 'edit':
+                results = run_batch_stage(request_id, state, lambda d: voice_and_brand_edit_params(
+                    prompt, d['question'], d['answer'], d['template'], d['content'], brand_voice
+                ))
+                state['drafts'] = [dict(d, content=results[i]) for i, d in enumerate(state['drafts']) if i in results]
+                state['stage'] = 'rewrite'
+                save_checkpoint(request_id, state)
+
+            # Ensure content is within character limit (interactive OpenAI calls),
+            # then set aside the drafts the local pre-screen rejects
+            if state['stage'] == 'rewrite':
+                drafts = []
+                state['prescreened'] = []
+                for draft in state['drafts']:
+                    if len(draft['content']) > 280:
+                        try:
+                            with metrics_utils.timed('stage.rewrite'):
+                                draft['content'] = rewrite_content_to_fit_limit(draft['content'])
+                        except Exception as e:
+                            logging.error(f"Error during content rewriting to fit limit: {e}")
+                            continue
+                    reason = prescreen.check(draft['content'])
+                    if reason:
+                        state['prescreened'].append(dict(draft, review=prescreen_result(reason)))
+                    else:
+                        drafts.append(draft)
+                state['drafts'] = drafts
+                state['stage'] = 'screen'
+                save_checkpoint(request_id, state)
+
+            # AI screening
+            if state['stage'] == 'screen':
+                results = run_batch_stage(request_id, state, lambda d: screen_content_params(d['content'], sample_content))
+                state['drafts'] = [dict(d, review=results[i]) for i, d in enumerate(state['drafts']) if i in results]
+                state.update(stage='salvage' if salvage_rounds else 'save', salvage_round=0, salvage=None)
+                save_checkpoint(request_id, state)
+
+            # Salvage: screen the copy the screener suggested for rejected drafts
+            # instead of regenerating them
+            while state['stage'] == 'salvage':
+                if state.get('salvage') is None:
+                    state['salvage'] = []
+                    for index, draft in enumerate(state['drafts']):
+                        review = parse_screening_result(draft['review'])
+                        suggested = review['suggested_copy']
+                        if review['approved'] or not suggested:
+                            continue
+                        if prescreen.check(suggested, replaces=draft['content']):
+                            metrics_utils.increment('salvage.dropped')
+                            continue
+                        draft['suggested'] = suggested
+                        state['salvage'].append(index)
+                    metrics_utils.increment('salvage.attempted', len(state['salvage']))
+                    save_checkpoint(request_id, state)
+                results = run_batch_stage(
+                    request_id, state, lambda d: screen_content_params(d['suggested'], sample_content), state['salvage']
+                )
+                for index, text in results.items():
+                    draft = state['drafts'][index]
+                    draft.setdefault('original', draft['content'])
+                    draft.update(content=draft.pop('suggested'), review=text)
+                    if parse_screening_result(text)['approved']:
+                        metrics_utils.increment('salvage.approved')
+                state['salvage_round'] += 1
+                done = not results or state['salvage_round'] >= salvage_rounds
+                state.update(stage='save' if done else 'salvage', salvage=None)
+                save_checkpoint(request_id, state)
+
+            # Save the screened drafts; approvals beyond the requested amount are surplus
+            if state['stage'] == 'save':
+                if lease_lost.is_set():
+                    logging.warning(f"Stopping request ID: {request_id}: taken over by another process")
+                    return state['approved']
+                screened = state['drafts'] + state.get('prescreened', [])
+                for draft in screened:
+                    review = parse_screening_result(draft['review'])
+                    planner.record(round_cost.usd / len(screened), review['approved'])
+                    # The template and source are credited with the first screening only;
+                    # a salvaged draft was rejected there
+                    if draft.get('template_id'):
+                        airtable_client.record_screening_outcome(
+                            user_id, draft['template_id'], draft.get('source_id'),
+                            review['approved'] and 'original' not in draft
+                        )
+                    if review['approved'] and state['approved'] >= amount_to_generate:
+                        continue
+                    screening_result = review['screening_result']
+                    if 'original' in draft:
+                        screening_result += f"\n\nSalvaged from the screener's suggested copy. Original draft:\n{draft['original']}"
+                    try:
+                        airtable_client.save_generated_content({
+                            'Generation Request': [request_id],
+                            'First draft': draft['content'],
+                            'AI screen': 'Approved' if review['approved'] else 'Rejected',
+                            'Screening Result': screening_result,
+                        }, user_id)
+                    except Exception as e:
+                        logging.error(f"Error saving generated content to Airtable: {e}")
+                        continue
+                    if review['approved']:
+                        state['approved'] += 1
+                with metrics_utils.timed('stage.flush'):
+                    airtable_client.flush_generated_content()
+                state.update(stage=None, drafts=[], prescreened=[])
+                save_checkpoint(request_id, state)
+
+    save_checkpoint(request_id, None)
+    metrics_utils.increment('drafts.approved', state['approved'])
+    logging.info(f"Request ID: {request_id} finished in bulk mode with {state['approved']}/{amount_to_generate} approved after {state['round']} rounds")
+    return state['approved']
@@ -0,0 +1,145 @@
+# combination_sampler.py
+
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import metrics_utils
+
+
+class CombinationSampler:
+    """
+    Draws (QA pair, template) combinations without replacement per user and
+    source set.
+
+    QA pairs are walked in a shuffled order, one round at a time: in round r
+    every pair that has been used with at most r templates gets a template it
+    has not been used with yet. Pairs never used come first and no combination
+    repeats until all of them have been drawn, after which a new cycle starts.
+    Used combinations are stored in SQLite so they survive restarts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._used = {}
+        self._orders = {}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS used_combinations (
+                    key TEXT NOT NULL,
+                    qa_pair_id TEXT NOT NULL,
+                    template_id TEXT NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (key, qa_pair_id, template_id)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def make_key(user_id, source_ids):
+        sources = ",".join(sorted(str(s) for s in source_ids or []))
+        return hashlib.sha256(f"{user_id}|{sources}".encode()).hexdigest()[:32]
+
+    def _load(self, key):
+        # Used combinations of key: {qa_pair_id: set of template_ids}
+        used = self._used.get(key)
+        if used is None:
+            used = {}
+            try:
+                with self._connect() as conn:
+                    rows = conn.execute(
+                        "SELECT qa_pair_id, template_id FROM used_combinations WHERE key = ?", (key,)
+                    ).fetchall()
+                for qa_pair_id, template_id in rows:
+                    used.setdefault(qa_pair_id, set()).add(template_id)
+            except sqlite3.Error as e:
+                logging.error(f"Error reading used combinations: {e}")
+            self._used[key] = used
+        return used
+
+    def _order(self, key, qa_pair_ids):
+        # A shuffled order of the QA pairs, kept while the set of pairs is unchanged
+        order = self._orders.get(key)
+        if order is None or len(order) != len(qa_pair_ids) or set(order) != set(qa_pair_ids):
+            order = list(qa_pair_ids)
+            random.shuffle(order)
+            self._orders[key] = order
+        return order
+
+    def _next(self, used, order, template_ids, preferred=None):
+        # Pairs used with templates that no longer exist come up in a later round,
+        # so go one round past the most used pair
+        rounds = 1 + max((len(done) for done in used.values()), default=0)
+        for round_number in range(rounds):
+            for qa_pair_id in order:
+                if preferred is not None and qa_pair_id not in preferred:
+                    continue
+                done = used.get(qa_pair_id, ())
+                if len(done) > round_number:
+                    continue
+                unused = [t for t in template_ids if t not in done]
+                if unused:
+                    return qa_pair_id, unused
+        return None, None
+
+    def _record(self, key, qa_pair_id, template_id):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO used_combinations (key, qa_pair_id, template_id, used_at) VALUES (?, ?, ?, ?)",
+                    (key, qa_pair_id, template_id, time.time()),
+                )
+        except sqlite3.Error as e:
+            logging.error(f"Error recording used combination: {e}")
+
+    def _reset(self, key):
+        self._used[key] = {}
+        self._orders.pop(key, None)
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM used_combinations WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logging.error(f"Error resetting used combinations: {e}")
+
+    def pick(self, user_id, source_ids, qa_pairs, templates, choose_template=random.choice, preferred=None):
+        """
+        Return an unused (QA pair, template) record pair, or (None, None) if
+        either list is empty. choose_template(template_ids) picks among the
+        templates not yet used with the chosen QA pair. If preferred (a set of
+        QA pair IDs) is given, those pairs are drawn from while they have
+        unused combinations.
+        """
+        if not qa_pairs or not templates:
+            return None, None
+        qa_pairs_by_id = {record['id']: record for record in qa_pairs}
+        templates_by_id = {record['id']: record for record in templates}
+        key = self.make_key(user_id, source_ids)
+        with self._lock:
+            used = self._load(key)
+            order = self._order(key, list(qa_pairs_by_id))
+            qa_pair_id, unused = None, None
+            if preferred:
+                qa_pair_id, unused = self._next(used, order, list(templates_by_id), preferred)
+            if qa_pair_id is None:
+                qa_pair_id, unused = self._next(used, order, list(templates_by_id))
+            if qa_pair_id is None:
+                # Every combination has been drawn: start a new cycle
+                logging.info(f"All {len(qa_pairs_by_id) * len(templates_by_id)} QA pair/template combinations used, starting over")
+                metrics_utils.increment('sampler.cycles')
+                self._reset(key)
+                used = self._used[key]
+                qa_pair_id, unused = self._next(used, self._order(key, list(qa_pairs_by_id)), list(templates_by_id))
+            template_id = choose_template(unused)
+            used.setdefault(qa_pair_id, set()).add(template_id)
+            self._record(key, qa_pair_id, template_id)
+        metrics_utils.increment('sampler.picks')
+        return qa_pairs_by_id[qa_pair_id], templates_by_id[template_id]
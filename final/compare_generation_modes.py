@@ -0,0 +1,103 @@
+# compare_generation_modes.py
+#
+# Side-by-side comparison of the two-pass (draft, then brand edit) and the
+# single-pass generation modes on the same QA pair / template inputs.
+#
+# Usage: python compare_generation_modes.py <generation request ID> [--samples N]
+
+import argparse
+import random
+import time
+import logging
+from airtable_utils import AirtableClient
+from ai_utils import (
+    generate_content_with_claude,
+    voice_and_brand_edit_with_claude,
+    generate_and_edit_with_claude,
+    rewrite_content_to_fit_limit,
+    ai_screen_content,
+    is_screening_approved,
+    generate_content_prompt,
+)
+import metrics_utils
+
+GENERATION_MODEL = "claude-3-opus-20240229"
+
+def generation_tokens():
+    # Input + output tokens spent on the generation model so far
+    counters = metrics_utils.snapshot()['counters']
+    return sum(
+        counters.get(f"llm.{kind}.{GENERATION_MODEL}", 0)
+        for kind in ('input_tokens', 'output_tokens', 'cache_read_tokens', 'cache_write_tokens')
+    )
+
+def run_mode(mode, prompt, question, answer, template, brand_voice, sample_content):
+    """
+    Generate and screen one draft. Returns (latency, tokens, approved, content).
+    """
+    tokens_before = generation_tokens()
+    started = time.monotonic()
+    if mode == 'single_pass':
+        content = generate_and_edit_with_claude(prompt, question, answer, template, brand_voice)
+    else:
+        content = generate_content_with_claude(prompt, question, answer, template)
+        content = voice_and_brand_edit_with_claude(prompt, question, answer, template, content, brand_voice)
+    latency = time.monotonic() - started
+    tokens = generation_tokens() - tokens_before
+
+    # Rewrite and screening are the same in both modes and are not timed
+    if len(content) > 280:
+        content = rewrite_content_to_fit_limit(content)
+    approved = is_screening_approved(ai_screen_content(content, sample_content))
+    return latency, tokens, approved, content
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two-pass and single-pass generation")
+    parser.add_argument('request_id', help="Generation Form Request record to take the inputs from")
+    parser.add_argument('--samples', type=int, default=10, help="QA pair / template inputs to try")
+    args = parser.parse_args()
+
+    airtable_client = AirtableClient()
+    request = airtable_client.generation_requests_table.get(args.request_id)
+    fields = request['fields']
+    user = airtable_client.get_user_by_id(fields['Accounts (Users)'][0])
+    brand_voice = user['fields'].get('Brand Voice', '')
+    sample_content = airtable_client.get_sample_content(user)
+    source_ids = fields.get("Source_ID (from Source to Generate From?)", [])
+    templates = airtable_client.get_templates(fields.get('Type'), fields.get('Template Tag To Use', []), fields.get('Select 2'))
+    if not templates:
+        print("No templates available.")
+        return
+    prompt = generate_content_prompt(brand_voice)
+
+    results = {'two_pass': [], 'single_pass': []}
+    for sample in range(args.samples):
+        qa_pair = airtable_client.get_random_qa_pair(source_ids)
+        if not qa_pair:
+            print("No QA pairs available.")
+            return
+        question = qa_pair['fields'].get('Question', '')
+        answer = qa_pair['fields'].get('Answer', '')
+        template = random.choice(templates)['fields'].get('Template', '')
+
+        # Both modes get the same inputs, in alternating order to spread any cache warm-up
+        modes = ['two_pass', 'single_pass'] if sample % 2 == 0 else ['single_pass', 'two_pass']
+        for mode in modes:
+            try:
+                results[mode].append(run_mode(mode, prompt, question, answer, template, brand_voice, sample_content))
+            except Exception as e:
+                logging.error(f"Error running {mode} on sample {sample + 1}: {e}")
+
+    print(f"{'mode':<12} {'samples':>7} {'avg latency (s)':>16} {'avg tokens':>11} {'approval rate':>14}")
+    for mode, rows in results.items():
+        if not rows:
+            print(f"{mode:<12} {0:>7}")
+            continue
+        latency = sum(row[0] for row in rows) / len(rows)
+        tokens = sum(row[1] for row in rows) / len(rows)
+        approval = sum(1 for row in rows if row[2]) / len(rows)
+        print(f"{mode:<12} {len(rows):>7} {latency:>16.2f} {tokens:>11.0f} {approval:>14.0%}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,147 @@
+# http_pool.py
+#
+# Shared HTTP connection settings. Airtable calls go through one requests
+# session per base whose urllib3 pool is sized to the number of worker threads
+# and blocks instead of opening throwaway connections when it is exhausted.
+# The Anthropic and OpenAI clients get httpx clients with explicit pool limits
+# and timeouts. For every service the requests sent, connections opened, TLS
+# handshakes and the time spent waiting for a pooled connection are recorded,
+# so /metrics shows whether connections are being reused.
+
+import time
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from dotenv import dotenv_values
+import metrics_utils
+
+# Load environment variables from .env file
+secrets = dotenv_values(".env")
+
+# Airtable: connections kept per base (one per thread that calls Airtable at the
+# same time) and connect / read timeouts in seconds
+AIRTABLE_POOL_SIZE = int(secrets.get("AIRTABLE_POOL_SIZE", 20))
+AIRTABLE_CONNECT_TIMEOUT = float(secrets.get("AIRTABLE_CONNECT_TIMEOUT", 5))
+AIRTABLE_READ_TIMEOUT = float(secrets.get("AIRTABLE_READ_TIMEOUT", 30))
+
+# Anthropic and OpenAI: open connections per client, how many of them are kept
+# alive between calls and for how long, and connect / read timeouts in seconds
+# (a long Opus completion can take minutes)
+LLM_MAX_CONNECTIONS = int(secrets.get("LLM_MAX_CONNECTIONS", 50))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(secrets.get("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+LLM_KEEPALIVE_EXPIRY = float(secrets.get("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_CONNECT_TIMEOUT = float(secrets.get("LLM_CONNECT_TIMEOUT", 10))
+LLM_READ_TIMEOUT = float(secrets.get("LLM_READ_TIMEOUT", 600))
+
+SERVICES = ('airtable', 'anthropic', 'openai')
+
+
+def _instrumented_pool(base, service):
+    # urllib3 pool class recording pool waits and (re)connects of service
+    tls = issubclass(base, HTTPSConnectionPool)
+
+    class ConnectionCls(base.ConnectionCls):
+        def connect(self):
+            metrics_utils.increment(f'http.connections_opened.{service}')
+            if tls:
+                metrics_utils.increment(f'http.tls_handshakes.{service}')
+            super().connect()
+
+    class Pool(base):
+        def _get_conn(self, timeout=None):
+            started = time.perf_counter()
+            conn = super()._get_conn(timeout)
+            metrics_utils.record_timing(f'http.pool_wait.{service}', time.perf_counter() - started)
+            return conn
+
+    Pool.ConnectionCls = ConnectionCls
+    return Pool
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    requests adapter with a blocking pool of pool_size connections per host
+    that records connection stats under service
+    """
+
+    def __init__(self, service, pool_size, max_retries=0):
+        self.service = service
+        super().__init__(pool_maxsize=pool_size, pool_block=True, max_retries=max_retries)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _instrumented_pool(HTTPConnectionPool, self.service),
+            'https': _instrumented_pool(HTTPSConnectionPool, self.service),
+        }
+
+    def send(self, request, **kwargs):
+        metrics_utils.increment(f'http.requests.{self.service}')
+        return super().send(request, **kwargs)
+
+
+def mount_pooled_adapter(session, service, pool_size, max_retries=0):
+    """
+    Replace the adapters of a requests session with one PooledAdapter
+    """
+    adapter = PooledAdapter(service, pool_size, max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return adapter
+
+
+def llm_http_client(service, client_class=httpx.Client):
+    """
+    httpx client with the configured pool limits and timeouts that records
+    connection stats under service. client_class is the SDK's
+    DefaultHttpxClient so its other defaults are kept.
+    """
+    def on_request(request):
+        metrics_utils.increment(f'http.requests.{service}')
+        started = time.perf_counter()
+        waiting = [True]
+
+        def trace(event, info):
+            # The first network event is a new connection or a request on a pooled one
+            if waiting[0] and event in ('connection.connect_tcp.started', 'http11.send_request_headers.started',
+                                        'http2.send_request_headers.started'):
+                waiting[0] = False
+                metrics_utils.record_timing(f'http.pool_wait.{service}', time.perf_counter() - started)
+            if event == 'connection.connect_tcp.complete':
+                metrics_utils.increment(f'http.connections_opened.{service}')
+            elif event == 'connection.start_tls.complete':
+                metrics_utils.increment(f'http.tls_handshakes.{service}')
+
+        request.extensions['trace'] = trace
+
+    return client_class(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=llm_timeout(),
+        event_hooks={'request': [on_request]},
+    )
+
+
+def llm_timeout():
+    return httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def connection_stats():
+    """
+    Requests, connections opened, TLS handshakes and the share of requests
+    sent on a reused connection, per service
+    """
+    stats = {}
+    for service in SERVICES:
+        requests = metrics_utils.get_counter(f'http.requests.{service}')
+        connections = metrics_utils.get_counter(f'http.connections_opened.{service}')
+        stats[service] = {
+            'requests': requests,
+            'connections_opened': connections,
+            'tls_handshakes': metrics_utils.get_counter(f'http.tls_handshakes.{service}'),
+            'reuse_rate': 1 - connections / requests if requests else None,
+        }
+    return stats
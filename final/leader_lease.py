@@ -0,0 +1,108 @@
+# leader_lease.py
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import metrics_utils
+
+
+class LeaderLease:
+    """
+    Leader election over a lease row in SQLite, shared by every process that
+    opens the same file (gunicorn workers, or replicas on a shared volume).
+
+    renew() takes the lease if it is free, expired or already ours and pushes
+    its expiry ttl seconds ahead, all in one IMMEDIATE transaction, so only
+    one process can hold it. Called every few seconds, a dead leader is
+    replaced within ttl plus one renewal interval. The holder treats the
+    lease as lost a quarter of the ttl before it expires, so a process whose
+    renewals stall stops leading before anyone else can start.
+    """
+
+    def __init__(self, path, name, ttl):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._valid_until = 0.0
+        self._leading = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Autocommit mode, so transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @property
+    def is_leader(self):
+        return time.time() < self._valid_until
+
+    def renew(self):
+        """
+        Take or extend the lease. Returns True while this process holds it.
+        """
+        with self._lock:
+            now = time.time()
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    row = conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (self.name,)).fetchone()
+                    acquired = row is None or row[0] == self.holder or row[1] <= now
+                    if acquired:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                            (self.name, self.holder, now + self.ttl),
+                        )
+                    conn.execute("COMMIT")
+                finally:
+                    conn.close()
+                if acquired:
+                    self._valid_until = now + self.ttl * 0.75
+            except sqlite3.Error as e:
+                # Keep leading until the last successful renewal runs out
+                logging.error(f"Error renewing the {self.name} lease: {e}")
+
+            leading = self.is_leader
+            if leading != self._leading:
+                self._leading = leading
+                metrics_utils.increment('leader.transitions')
+                if leading:
+                    logging.info(f"{self.holder} is now the {self.name} leader")
+                else:
+                    logging.info(f"{self.holder} is no longer the {self.name} leader")
+            metrics_utils.set_gauge(f'leader.{self.name}', 1 if leading else 0)
+            return leading
+
+    def release(self):
+        """
+        Give the lease up (e.g. on shutdown) so another process can take over at once
+        """
+        with self._lock:
+            self._valid_until = 0.0
+            self._leading = False
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error releasing the {self.name} lease: {e}")
@@ -0,0 +1,81 @@
+# metrics_utils.py
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Process-wide counters, gauges and timing summaries. Everything is kept in
+# memory and exposed through the /metrics route of the web app.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}
+
+
+def increment(name, amount=1):
+    """
+    Add amount to the counter called name
+    """
+    with _lock:
+        _counters[name] += amount
+
+
+def set_gauge(name, value):
+    """
+    Record the current value of a gauge
+    """
+    with _lock:
+        _gauges[name] = value
+
+
+def record_timing(name, seconds):
+    """
+    Add one observation (in seconds) to the timing summary called name
+    """
+    with _lock:
+        summary = _timings.get(name)
+        if summary is None:
+            summary = _timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+        summary['count'] += 1
+        summary['total'] += seconds
+        summary['max'] = max(summary['max'], seconds)
+
+
+@contextmanager
+def timed(name):
+    """
+    Record the duration of the with-block under name
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started)
+
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot():
+    """
+    Return a copy of all metrics, with the mean added to each timing
+    """
+    with _lock:
+        timings = {}
+        for name, summary in _timings.items():
+            timings[name] = dict(summary, mean=summary['total'] / summary['count'])
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': timings,
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
@@ -0,0 +1,125 @@
+# prescreen.py
+#
+# Deterministic checks run on every draft before the LLM screener. They cover
+# the rules the pipeline already knows (character limit, no emojis or hashtags),
+# empty drafts and model refusals, near-duplicates of earlier drafts of the
+# same request and, when given a lookup, of the user's earlier requests.
+# Drafts failing a check are rejected locally and never cost a screening call.
+
+import logging
+import re
+import threading
+from dotenv import dotenv_values
+import metrics_utils
+
+# Load environment variables from .env file
+secrets = dotenv_values(".env")
+
+# Word 3-gram Jaccard similarity at or above which a draft counts as a repeat
+PRESCREEN_SIMILARITY = float(secrets.get("PRESCREEN_SIMILARITY", 0.6))
+
+MAX_CHARACTERS = 280
+
+# Pictographs, dingbats, flags and the joiners/selectors used to build emoji sequences
+EMOJI_PATTERN = re.compile(
+    "[\U0001F000-\U0001FAFF\U00002600-\U000027BF\U00002B00-\U00002BFF\uFE0F\u200D]"
+)
+# "#tag", but not "C#" or "&#39;"
+HASHTAG_PATTERN = re.compile(r'(?<![\w&])#[^\W\d_]\w*')
+# A model declining the task, not a first-person hook: "I can't / won't ..." only
+# counts after an apology ("I'm sorry, but I can't write...") or when it is about
+# the request itself ("I can't help with that.", "I cannot comply with this request.")
+_DECLINE = (
+    r"i(?: can(?:not|['’]t| not)| won['’]?t| will not|['’]?m (?:not able|unable)| am (?:not able|unable)) (?:to )?"
+    r"(?:help|assist|comply|fulfil+|provide|write|create|generate|produce)"
+)
+REFUSAL_PATTERN = re.compile(
+    r"^\W*(?:(?:i['’]?m |i am )?sorry|i apologi[sz]e)[\s,.!]*(?:but\s+)?" + _DECLINE + r"\b"
+    r"|^\W*" + _DECLINE + r"(?: you)?(?: with)? (?:that|this|it|your request)(?: request| content| post)?[.!,]"
+    r"|\bas an ai (?:language model|model|assistant)\b",
+    re.IGNORECASE,
+)
+
+def shingles(text, size=3):
+    # Set of word n-grams, ignoring case and punctuation
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def prescreen_result(reason):
+    """
+    Screening Result text for a draft rejected by the pre-screen, in the same
+    format as the LLM screener's reviews
+    """
+    return f"No\n\n• Pre-screen: {reason}"
+
+class PreScreen:
+    """
+    Pre-screen for the drafts of one request. Remembers the drafts it passed
+    so later drafts can be compared against them. find_duplicate(content), if
+    given, returns the distance to a near-identical earlier draft of the user
+    or None. Thread-safe.
+    """
+
+    def __init__(self, similarity_threshold=PRESCREEN_SIMILARITY, max_characters=MAX_CHARACTERS,
+                 find_duplicate=None):
+        self.similarity_threshold = similarity_threshold
+        self.max_characters = max_characters
+        self.find_duplicate = find_duplicate
+        self._lock = threading.Lock()
+        self._seen = []
+
+    def check(self, content, replaces=None):
+        """
+        Return the reason content fails the pre-screen, or None if it passes.
+        replaces is a draft that content supersedes (e.g. a rejected draft and
+        the screener's rewrite of it): it is not compared against and, if
+        content passes, is forgotten.
+        """
+        reason = self._rule_violation(content)
+        if reason is None:
+            current = shingles(content)
+            previous = shingles(replaces) if replaces is not None else None
+            with self._lock:
+                similarity = max((jaccard(current, seen) for seen in self._seen if seen != previous), default=0.0)
+                if similarity >= self.similarity_threshold:
+                    reason = f"near-duplicate of an earlier draft ({similarity:.0%} similar)"
+                else:
+                    if previous in self._seen:
+                        self._seen.remove(previous)
+                    self._seen.append(current)
+        if reason is None and self.find_duplicate is not None:
+            distance = self.find_duplicate(content)
+            if distance is not None:
+                reason = f"repeat of an earlier draft for this user (SimHash distance {distance})"
+
+        metrics_utils.increment('prescreen.checked')
+        if reason:
+            rule = reason.split(' ', 1)[0].strip(':')
+            metrics_utils.increment('prescreen.rejected')
+            metrics_utils.increment(f'prescreen.rejected.{rule}')
+            logging.info(f"Draft rejected by pre-screen: {reason}")
+        checked = metrics_utils.get_counter('prescreen.checked')
+        metrics_utils.set_gauge('prescreen.hit_rate', metrics_utils.get_counter('prescreen.rejected') / checked)
+        return reason
+
+    def _rule_violation(self, content):
+        text = (content or '').strip()
+        if not text:
+            return "empty draft"
+        if REFUSAL_PATTERN.match(text):
+            return "refusal instead of a draft"
+        if len(text) > self.max_characters:
+            return f"length {len(text)} characters is over the {self.max_characters} limit"
+        if EMOJI_PATTERN.search(text):
+            return "emoji in draft"
+        hashtag = HASHTAG_PATTERN.search(text)
+        if hashtag:
+            return f"hashtag {hashtag.group(0)} in draft"
+        return None
@@ -0,0 +1,296 @@
+# request_leases.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import metrics_utils
+
+
+def rendezvous_owner(key, nodes):
+    """
+    The node a key belongs to under rendezvous (highest random weight)
+    hashing: adding or removing a node only moves the keys it wins or owned
+    """
+    if not nodes:
+        return None
+    return max(nodes, key=lambda node: hashlib.sha1(f"{node}|{key}".encode()).digest())
+
+
+class RequestLeases:
+    """
+    Generation requests shared by every process that opens the same SQLite
+    file, and the leases of the processes working on them.
+
+    The leader registers every request it fetches. Each process claims the
+    unfinished requests whose shard key (the user) hashes to its node among
+    the nodes with a live heartbeat, by writing itself as holder with an
+    expiry ttl seconds ahead in an IMMEDIATE transaction. heartbeat() keeps
+    the node alive and extends its leases; when a process stops renewing, its
+    node drops out of the hash and its leases expire, so the other nodes pick
+    its users and requests up. A process that finds one of its requests taken
+    over has the request's lost event set (see lost_event) and must stop
+    working on it; finish() only completes requests this process still holds.
+
+    The cursor for the next Airtable query is the latest createdTime below
+    which every registered request is done, so a crash never skips a request
+    that was still running; on_advance is called with it whenever it moves.
+    """
+
+    def __init__(self, path, node_id, ttl, default_watermark, on_advance=None):
+        self.path = path
+        self.node_id = node_id
+        # Processes sharing a node id (e.g. gunicorn workers) still hold their own leases
+        self.holder = f"{node_id}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl = ttl
+        self.default_watermark = default_watermark
+        self.on_advance = on_advance
+        self._lock = threading.Lock()
+        # Request ID -> event set when the lease has been taken over by another process
+        self._held = {}
+        self._watermark = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS nodes (
+                    node_id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS request_leases (
+                    request_id TEXT PRIMARY KEY,
+                    shard_key TEXT NOT NULL,
+                    created_time TEXT NOT NULL,
+                    record TEXT NOT NULL,
+                    holder TEXT,
+                    expires_at REAL NOT NULL DEFAULT 0,
+                    done INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS request_leases_open ON request_leases (done, created_time)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Autocommit mode, so transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _beat(self, conn, now):
+        conn.execute(
+            "INSERT OR REPLACE INTO nodes (node_id, expires_at) VALUES (?, ?)",
+            (self.node_id, now + self.ttl),
+        )
+        conn.execute("DELETE FROM nodes WHERE expires_at <= ?", (now,))
+
+    def in_flight(self):
+        """
+        Number of requests this process has claimed and not finished
+        """
+        with self._lock:
+            return len(self._held)
+
+    def lost_event(self, request_id):
+        """
+        Event set once another process has taken over a claimed request
+        """
+        with self._lock:
+            event = self._held.get(request_id)
+        return event if event is not None else threading.Event()
+
+    def heartbeat(self):
+        """
+        Keep this node in the hash and extend the leases of its requests.
+        Requests whose lease was taken over meanwhile get their lost event set.
+        """
+        # Claims made after this point are committed after the check below, so only these are checked
+        with self._lock:
+            checked = set(self._held)
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                self._beat(conn, now)
+                conn.execute(
+                    "UPDATE request_leases SET expires_at = ? WHERE holder = ? AND done = 0",
+                    (now + self.ttl, self.holder),
+                )
+                still_held = {row[0] for row in conn.execute(
+                    "SELECT request_id FROM request_leases WHERE holder = ? AND done = 0", (self.holder,)
+                )}
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error renewing request leases: {e}")
+            return
+        with self._lock:
+            lost = [request_id for request_id, event in self._held.items()
+                    if request_id in checked and request_id not in still_held and not event.is_set()]
+            for request_id in lost:
+                self._held[request_id].set()
+        for request_id in lost:
+            metrics_utils.increment('leases.lost')
+            logging.warning(f"Lease on request {request_id} was taken over by another process, stopping it")
+
+    def watermark(self):
+        """
+        Latest createdTime below which every registered request is done
+        """
+        try:
+            conn = self._connect()
+            try:
+                oldest_open = conn.execute("SELECT MIN(created_time) FROM request_leases WHERE done = 0").fetchone()[0]
+                if oldest_open is None:
+                    row = conn.execute("SELECT MAX(created_time) FROM request_leases WHERE done = 1").fetchone()
+                else:
+                    row = conn.execute(
+                        "SELECT MAX(created_time) FROM request_leases WHERE done = 1 AND created_time < ?",
+                        (oldest_open,),
+                    ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error reading the request watermark: {e}")
+            return self._watermark or self.default_watermark
+        watermark = max(row[0] or self.default_watermark, self.default_watermark)
+        if watermark != self._watermark:
+            self._watermark = watermark
+            if self.on_advance:
+                self.on_advance(watermark)
+        return watermark
+
+    def register(self, requests, shard_key):
+        """
+        Add requests fetched from Airtable; ones already registered are left as they are
+        """
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO request_leases (request_id, shard_key, created_time, record) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(request['id'], shard_key(request), request['createdTime'], json.dumps(request))
+                     for request in requests],
+                )
+                added = conn.total_changes - before
+                conn.execute("COMMIT")
+            finally:
+                conn.close()
+            metrics_utils.increment('leases.registered', added)
+            return added
+        except sqlite3.Error as e:
+            logging.error(f"Error registering generation requests: {e}")
+            return 0
+
+    def claim(self, max_in_flight):
+        """
+        Claim open requests of this node, oldest first, until this process
+        holds max_in_flight. Returns the claimed request records.
+        """
+        with self._lock:
+            wanted = max_in_flight - len(self._held)
+            if wanted <= 0:
+                return []
+            now = time.time()
+            claimed = []
+            try:
+                conn = self._connect()
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    self._beat(conn, now)
+                    nodes = [row[0] for row in conn.execute("SELECT node_id FROM nodes")]
+                    rows = conn.execute(
+                        "SELECT request_id, shard_key, record, holder FROM request_leases "
+                        "WHERE done = 0 AND (holder IS NULL OR expires_at <= ?) ORDER BY created_time",
+                        (now,),
+                    ).fetchall()
+                    for request_id, key, record, previous in rows:
+                        if len(claimed) == wanted:
+                            break
+                        # A lapsed lease of our own is still being worked on here
+                        if request_id in self._held or rendezvous_owner(key, nodes) != self.node_id:
+                            continue
+                        conn.execute(
+                            "UPDATE request_leases SET holder = ?, expires_at = ? WHERE request_id = ?",
+                            (self.holder, now + self.ttl, request_id),
+                        )
+                        if previous is not None:
+                            metrics_utils.increment('leases.reclaimed')
+                        claimed.append(json.loads(record))
+                    conn.execute("COMMIT")
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logging.error(f"Error claiming generation requests: {e}")
+                return []
+            self._held.update((request['id'], threading.Event()) for request in claimed)
+            metrics_utils.increment('leases.claimed', len(claimed))
+            return claimed
+
+    def finish(self, request_id):
+        """
+        Mark a claimed request as done, unless another process has taken it
+        over, and drop done requests below the watermark
+        """
+        with self._lock:
+            self._held.pop(request_id, None)
+        try:
+            conn = self._connect()
+            try:
+                finished = conn.execute(
+                    "UPDATE request_leases SET done = 1, holder = NULL WHERE request_id = ? AND holder = ?",
+                    (request_id, self.holder),
+                ).rowcount
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error finishing request {request_id}: {e}")
+            return
+        if not finished:
+            logging.warning(f"Request {request_id} is held by another process, leaving it to finish it")
+            return
+        watermark = self.watermark()
+        try:
+            conn = self._connect()
+            try:
+                # The row at the watermark stays so the watermark survives
+                conn.execute(
+                    "DELETE FROM request_leases WHERE done = 1 AND created_time < ?",
+                    (watermark,),
+                )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error pruning finished requests: {e}")
+
+    def release(self):
+        """
+        Hand the unfinished requests of this process back and leave the hash
+        (e.g. on shutdown). Other processes of the node rejoin on their next
+        heartbeat.
+        """
+        with self._lock:
+            self._held.clear()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM nodes WHERE node_id = ?", (self.node_id,))
+                conn.execute(
+                    "UPDATE request_leases SET holder = NULL, expires_at = 0 WHERE holder = ? AND done = 0",
+                    (self.holder,),
+                )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error releasing request leases: {e}")
@@ -3,7 +3,10 @@
 import time
 import random
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import dotenv_values
 from airtable_utils import AirtableClient
+from request_cursor import CursorWatermark
 from ai_utils import (
     generate_content_with_claude,
     voice_and_brand_edit_with_claude,
@@ -13,6 +16,11 @@ from ai_utils import (
 )
 
 
+# Number of generation requests processed in parallel. Defaults to 1: the Airtable
+# and Anthropic clients used here are not rate-limited (final/ has the limited ones)
+secrets = dotenv_values(".env")
+REQUEST_WORKERS = max(1, int(secrets.get("REQUEST_WORKERS", 1)))
+
 # Initialize Airtable client
 airtable_client = AirtableClient()
 
@@ -32,8 +40,10 @@ def write_last_processed_time(last_time):
     """
     Write the last processed time to 'last_processed_time.txt'
     """
-    with open('last_processed_time.txt', 'w') as file:
+    # Write to a temp file first so a crash never leaves a truncated cursor
+    with open('last_processed_time.txt.tmp', 'w') as file:
         file.write(last_time)
+    os.replace('last_processed_time.txt.tmp', 'last_processed_time.txt')
 
 def process_generation_request(request):
     """
@@ -127,26 +137,38 @@ def process_generation_request(request):
         print(content_status)
         print("----------------------")
 
+def run_request(cursor, request):
+    """
+    Process one generation request on the pool and advance the cursor
+    """
+    try:
+        process_generation_request(request)
+    except Exception as e:
+        print(f"Error processing generation request {request['id']}: {e}")
+    finally:
+        cursor.finish(request['id'])
+
 def main():
-    while True:
-        print("Checking for new generation requests...")
-        last_processed_time = read_last_processed_time()
-        generation_requests = airtable_client.get_new_generation_requests(last_processed_time)
-        if generation_requests:
-            # Sort requests by 'Created Time' to process them in order
+    cursor = CursorWatermark(read_last_processed_time(), on_advance=write_last_processed_time)
+    with ThreadPoolExecutor(max_workers=REQUEST_WORKERS) as executor:
+        while True:
+            print("Checking for new generation requests...")
+            generation_requests = airtable_client.get_new_generation_requests(cursor.watermark)
+            # Sort requests by 'Created Time' so the oldest are picked up first, and
+            # skip the ones still running or already finished above the watermark
             generation_requests.sort(key=lambda x: x['createdTime'])
-            for request in generation_requests:
+            new_requests = [request for request in generation_requests if cursor.start(request)]
+            # Keep polling while the pool works; the cursor advances as requests finish
+            for request in new_requests:
                 print(f"Processing generation request ID: {request['id']}")
-                process_generation_request(request)
-                # Update the last processed time
-                last_processed_time = request['createdTime']
-                write_last_processed_time(last_processed_time)
-        else:
-            print("No new generation requests found.")
-            break
-
-        # Wait before checking again
-        time.sleep(30)
+                executor.submit(run_request, cursor, request)
+            if not new_requests:
+                print("No new generation requests found.")
+                if not cursor.in_flight():
+                    break
+
+            # Wait before checking again
+            time.sleep(30)
 
 if __name__ == "__main__":
     main()
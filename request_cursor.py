@@ -0,0 +1,63 @@
+# request_cursor.py
+
+import threading
+
+
+class CursorWatermark:
+    """
+    Tracks generation requests processed out of order and computes the
+    low-watermark for 'last_processed_time.txt'.
+
+    The watermark only moves to the highest createdTime below which every
+    request has completed, so a crash never skips a request that was still
+    running. Requests that finished above the watermark are remembered so the
+    next poll does not process them twice.
+    """
+
+    def __init__(self, watermark, on_advance=None):
+        self.watermark = watermark
+        self.on_advance = on_advance
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._completed = {}
+
+    def in_flight(self):
+        """
+        Number of requests started and not yet finished
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def start(self, request):
+        """
+        Mark a request as in flight. Returns False if it was already known.
+        """
+        with self._lock:
+            request_id = request['id']
+            if request_id in self._pending or request_id in self._completed:
+                return False
+            self._pending[request_id] = request['createdTime']
+            return True
+
+    def finish(self, request_id):
+        """
+        Mark a request as done and advance the watermark if possible
+        """
+        with self._lock:
+            created_time = self._pending.pop(request_id, None)
+            if created_time is None:
+                return self.watermark
+            self._completed[request_id] = created_time
+
+            # Everything completed strictly before the oldest pending request is safe
+            oldest_pending = min(self._pending.values()) if self._pending else None
+            safe_times = [t for t in self._completed.values() if oldest_pending is None or t < oldest_pending]
+            if safe_times:
+                new_watermark = max(safe_times)
+                if new_watermark > self.watermark:
+                    self.watermark = new_watermark
+                    if self.on_advance:
+                        self.on_advance(new_watermark)
+                # Requests at or below the watermark are excluded by the next query
+                self._completed = {rid: t for rid, t in self._completed.items() if t > self.watermark}
+            return self.watermark